@@ -5,7 +5,31 @@ class MyConfig:
     raw_dir_list = os.listdir('./data/ace_2005_td_v7/data/English/')
     word_embed_size = 100
     glove_txt_path = './data/glove/glove.6B/glove.6B.{}d.txt'.format(word_embed_size)
+    glove_cache_path = './data/glove_cache/'  # binary copy of the GloVe file, made on first use
+    glove_lru_size = 10000  # vectors of unseen words kept by the serving embedder
+    serving_glove_oov = True  # embed words missing from the training vocabulary with GloVe when serving
+    serving_multi_candidate = True  # serve with the multi_candidate graph of Model_Trigger, one encoding per sentence
     mark_long_entity_in_pos = True
+    dynamic_padding = True  # pad a batch to its longest sentence instead of max_sequence_length
+    bucket_batches = 50  # train batches cut from each length-sorted pool of shuffled candidates, 0 to disable
+    class_weights = None  # None shuffles the train set, 'uniform', 'inverse' or 'capped' samples it, see Sampler.py
+    class_weight_cap = 5.0  # largest up-weighting of a label with class_weights = 'capped'
+    none_ratio = None  # share of the None train candidates kept each epoch, e.g. 0.2, None keeps them all
+    none_per_sentence = None  # most None train candidates kept per sentence each epoch, None for no limit
+    none_seed = 0  # the None candidates of epoch e are drawn with seed none_seed + e
+    prefetch_batches = 4  # train batches made ahead by a background thread, 0 to make them in the loop
+    eval_batch_size = 1024  # candidates per sess.run when evaluating a split
+    dynamic_multi_pooling = False  # pool each feature map by segments around the trigger and the candidate (DMCNN)
+    conv_encoder = 'conv1d'  # 'conv2d', 'conv1d' or 'fused', same variables and checkpoints, see Layers.py
+    lexical_features = 'sentence'  # 'window' uses the words around the candidate (and trigger), restores only its own checkpoints
+    sparse_labels = True  # feed int32 label ids and use the sparse loss, False for one-hot input_y
+    preprocess_workers = 1  # >1 spreads the ACE documents over a process pool
+    preprocess_cache_path = './data/preprocess_cache/'  # per-document cache, None to disable
+    pos_tag_workers = 1  # >1 tags the sentences in a process pool
+    pos_tag_cache_path = './data/pos_cache/'  # POS tags by token sequence, None to disable
+    pos_tag_chunk_size = 10000  # sentences read and tagged at a time while a dataset is built
+    dataset_cache_path = './data/dataset_cache/'  # built datasets, see DatasetCache.py
+    split_seed = 0  # seed of the trigger train/valid/test split, a corpus always gets the same split
 
 
 class HyperParams:
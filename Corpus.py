@@ -0,0 +1,137 @@
+import os, json, shutil, tempfile
+import numpy as np
+
+"""
+Shared sentence table with compact candidates for the trigger and argument datasets.
+A candidate is (sentence id, candidate index, trigger index or -1, label id); its marks and
+position vectors are only made on demand, when a batch is built.
+
+On disk the corpus is columnar: one .npy file per column (flat int32 token and POS ids with
+per-sentence offsets, int32 candidate columns) and a JSON file with the string tables.
+load() memory-maps the columns, so nothing is unpickled and only the rows a batch touches are read.
+"""
+
+FORMAT_VERSION = 1
+COLUMNS = {
+    'tokens': np.int32,  # ids into words, all sentences back to back
+    'token_offsets': np.int64,  # sentence i is tokens[token_offsets[i]:token_offsets[i + 1]]
+    'pos': np.int32,  # ids into pos_tags, laid out like tokens
+    'pos_offsets': np.int64,
+    'sentence_fname': np.int32,  # ids into fnames
+    'candidate_sentence': np.int32,
+    'candidate_index': np.int32,
+    'candidate_trigger': np.int32,  # -1 for the trigger task
+    'candidate_label': np.int32,  # ids into labels
+}
+STRING_TABLES = ['words', 'pos_tags', 'fnames', 'labels']
+
+
+class Corpus():
+    def __init__(self):
+        # String tables, ids are given in order of first appearance
+        self.words, self.pos_tags, self.fnames, self.labels = [], [], [], []
+        self.word_id, self.pos_tag_id, self.fname_id, self.label_id = dict(), dict(), dict(), dict()
+        # Python lists while the corpus is built, numpy arrays after freeze() or load()
+        for column in COLUMNS: setattr(self, column, [])
+        self.token_offsets.append(0)
+        self.pos_offsets.append(0)
+
+    @staticmethod
+    def intern(table, ids, value):
+        if value not in ids:
+            ids[value] = len(table)
+            table.append(value)
+        return ids[value]
+
+    def add_sentence(self, words, pos_taggings, fname):
+        self.tokens.extend(self.intern(self.words, self.word_id, word) for word in words)
+        self.token_offsets.append(len(self.tokens))
+        self.pos.extend(self.intern(self.pos_tags, self.pos_tag_id, pos_tag) for pos_tag in pos_taggings)
+        self.pos_offsets.append(len(self.pos))
+        self.sentence_fname.append(self.intern(self.fnames, self.fname_id, fname))
+        return len(self.sentence_fname) - 1
+
+    def add_candidate(self, sent_id, cand_idx, label, trigger_idx=-1):
+        self.candidate_sentence.append(sent_id)
+        self.candidate_index.append(cand_idx)
+        self.candidate_trigger.append(trigger_idx)
+        self.candidate_label.append(self.intern(self.labels, self.label_id, label))
+
+    def freeze(self):
+        for column, dtype in COLUMNS.items():
+            setattr(self, column, np.asarray(getattr(self, column), dtype=dtype))
+
+    def num_sentences(self):
+        return len(self.sentence_fname)
+
+    def num_candidates(self):
+        return len(self.candidate_label)
+
+    def sentence_words(self, sent_id):
+        return [self.words[i] for i in self.tokens[self.token_offsets[sent_id]:self.token_offsets[sent_id + 1]]]
+
+    def sentence_pos_taggings(self, sent_id):
+        return [self.pos_tags[i] for i in self.pos[self.pos_offsets[sent_id]:self.pos_offsets[sent_id + 1]]]
+
+    def candidate(self, cand_id):
+        return (int(self.candidate_sentence[cand_id]), int(self.candidate_index[cand_id]),
+                int(self.candidate_trigger[cand_id]), int(self.candidate_label[cand_id]))
+
+    def fname(self, cand_id):
+        return self.fnames[self.sentence_fname[self.candidate_sentence[cand_id]]]
+
+    def marks(self, cand_id):
+        # 'B' for the candidate, 'T' for the trigger and 'A' for the others, as the former per-candidate lists
+        sent_id, cand_idx, trigger_idx, _ = self.candidate(cand_id)
+        marks = ['A'] * int(self.token_offsets[sent_id + 1] - self.token_offsets[sent_id])
+        marks[cand_idx] = 'B'
+        if trigger_idx >= 0: marks[trigger_idx] = 'T'
+        return marks
+
+    def save(self, path):
+        '''
+        Write the corpus into the directory path. It is written next to it first and renamed at the end,
+        an interrupted run must not leave a half written corpus behind. Every call writes its own temporary
+        directory, so runs building the same corpus at once do not overwrite each other.
+        '''
+        self.freeze()
+        path = path.rstrip('/')
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = tempfile.mkdtemp(dir=os.path.dirname(path) or '.', prefix=os.path.basename(path) + '.tmp-')
+        for column in COLUMNS:
+            np.save(os.path.join(tmp_path, column + '.npy'), getattr(self, column))
+        with open(os.path.join(tmp_path, 'strings.json'), 'w', encoding='utf8') as f:
+            json.dump(dict({'format_version': FORMAT_VERSION}, **{table: getattr(self, table) for table in STRING_TABLES}), f)
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            # Another run saved the same corpus first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            if not Corpus.exists(path): raise
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, 'strings.json'))
+
+    @staticmethod
+    def load(path, mmap=True):
+        corpus = Corpus()
+        with open(os.path.join(path, 'strings.json'), 'r', encoding='utf8') as f:
+            strings = json.load(f)
+        if strings['format_version'] != FORMAT_VERSION:
+            raise ValueError('corpus format {} is not {}: {}'.format(strings['format_version'], FORMAT_VERSION, path))
+        for table, ids in zip(STRING_TABLES, ['word_id', 'pos_tag_id', 'fname_id', 'label_id']):
+            setattr(corpus, table, strings[table])
+            setattr(corpus, ids, dict(zip(strings[table], range(len(strings[table])))))
+        for column in COLUMNS:
+            setattr(corpus, column, np.load(os.path.join(path, column + '.npy'), mmap_mode='r' if mmap else None))
+        return corpus
+
+
+if __name__ == '__main__':
+    # Load time of a saved corpus: python Corpus.py ./data/trigger_..._corpus
+    import sys, time
+    start = time.time()
+    corpus = Corpus.load(sys.argv[1])
+    print('sentences: {}  candidates: {}  labels: {}'.format(corpus.num_sentences(), corpus.num_candidates(), len(corpus.labels)))
+    print('load: {:.1f}ms'.format((time.time() - start) * 1000))
@@ -1,5 +1,9 @@
 import numpy as np
-from Util import one_hot, find_candidates
+from Corpus import Corpus
+from DatasetCache import DatasetCache, code_version
+from Config import MyConfig, HyperParams
+from PosTagger import PosTagger
+from Sampler import TrainIndex
 
 
 class Dataset:
@@ -22,6 +26,7 @@ class Dataset:
         self.all_pos_taggings = list()
         self.all_marks = list()
         self.all_labels = list()
+        self.corpus = None
         self.instances = list()
 
         self.word_id = dict()
@@ -33,55 +38,35 @@ class Dataset:
 
         self.word_embed = None
 
-        self.train_instances, self.eval_instances = [],[]
         self.divide_train_eval_data()
-        self.batch_nums = len(self.train_instances) // self.batch_size
-        self.index = np.arange(len(self.train_instances))
+        train_ids = np.asarray(self.train_instances, dtype=np.int64)
+        self.train_index = TrainIndex(np.asarray(self.corpus.candidate_label)[train_ids],
+                                      np.asarray(self.corpus.candidate_sentence)[train_ids],
+                                      len(self.all_labels), self.label_id.get('None'), MyConfig.class_weights,
+                                      MyConfig.class_weight_cap, MyConfig.none_ratio, MyConfig.none_per_sentence,
+                                      MyConfig.none_seed)
+        self.epoch = 0
+        self.epoch_size = self.train_index.size
+        self.batch_nums = self.epoch_size // self.batch_size
+        self.index = self.bucket(self.train_index.epoch_index(self.epoch))
         self.point = 0
         print('all label for dataset: {}'.format(len(self.all_labels)))
 
     def divide_train_eval_data(self):
-        testset_fname = []
-        for ins in self.instances:
-            if 'nw/adj' not in ins['fname']:
-                self.train_instances.append(ins)
-            elif ins['fname'] in testset_fname:
-                self.eval_instances.append(ins)
-            elif len(testset_fname) > 40:
-                self.train_instances.append(ins)
-            else:
-                testset_fname.append(ins['fname'])
-                self.eval_instances.append(ins)
+        # The candidates of the first 41 'nw/adj' files in corpus order are the test set, the rest the train set
+        is_adj = np.asarray(['nw/adj' in fname for fname in self.corpus.fnames], dtype=bool)
+        fname_ids = np.asarray(self.corpus.sentence_fname)[np.asarray(self.corpus.candidate_sentence)[self.instances]]
+        adj = is_adj[fname_ids]
+        _, first = np.unique(fname_ids[adj], return_index=True)
+        fname_rank = np.full(len(self.corpus.fnames), len(first), dtype=np.int64)
+        fname_rank[fname_ids[adj][np.sort(first)]] = np.arange(len(first))
+        test = adj & (fname_rank[fname_ids] <= 40)
+        self.train_instances, self.eval_instances = self.instances[~test], self.instances[test]
 
         print('TRAIN: {} TEST: {}'.format(len(self.train_instances), len(self.eval_instances)))
         assert len(self.instances) == (len(self.train_instances) + len(self.eval_instances))
 
     def read_dataset(self):
-        all_words, all_pos_taggings, all_labels, all_marks = [set() for _ in range(4)]
-
-        def read_one(words, marks, label, fname):
-            # TODO: remove comments mark when use POS tag info for model. `nltk.pos_tag()` method too slow.
-            #pos_taggings = nltk.pos_tag(words)
-            #pos_taggings = [pos_tagging[1] for pos_tagging in pos_taggings]
-            pos_taggings = [None for i in range(10)]
-
-            for word in words: all_words.add(word)
-            for mark in marks: all_marks.add(mark)
-            for pos_tag in pos_taggings: all_pos_taggings.add(pos_tag)
-            all_labels.add(label)
-
-            if len(words) > 80:
-                # print('len(word) > 80, Goodbye! ', len(words), words)
-                return
-
-            self.instances.append({
-                'words': words,
-                'pos_taggings': pos_taggings,
-                'marks': marks,
-                'label': label,
-                'fname':fname
-            })
-
         # current word: $500 billion
         # read_one(
         #     words=['It', 'could', 'swell', 'to', 'as', 'much', 'as', '$500 billion', 'if', 'we', 'go', 'to', 'war', 'in', 'Iraq'],
@@ -103,32 +88,81 @@ class Dataset:
 
         from Preprocess import PreprocessManager
         man = PreprocessManager()
-        man.preprocess(tasktype='ARGUMENT', subtasktype=self.dtype)
-        argument_classification_data = man.arg_task_format_data
-        for data in argument_classification_data:
-            read_one(words=data[0], marks=data[1], label=data[2], fname=data[3])
+        documents = man.iter_documents()
+        argument_classification_data = man.iter_argument_candidates(man.iter_sentences(documents), self.dtype)
+        # Everything the corpus is made from
+        cache = DatasetCache('argument_{}'.format(self.dtype.lower()), {
+            'corpus_digest': man.corpus_digest,
+            'dtype': self.dtype,
+            'mark_long_entity_in_pos': MyConfig.mark_long_entity_in_pos,
+            'code': code_version('Dataset.py', 'Corpus.py', 'PosTagger.py'),
+        })
+
+        if cache.has_corpus():
+            print('use previous instance data for argument task: {}'.format(cache.path))
+            corpus = cache.load_corpus()
+        else:
+            # len(word) > 80, Goodbye!
+            sentences = (data for data in argument_classification_data if len(data[0]) <= 80)
+            # One tagging per distinct sentence, the trigger task's taggings are reused from the cache
+            tagger = PosTagger()
+
+            corpus = Corpus()
+            for (words, entity_mark, fname, trigger_idx, candidates), tags in tagger.tag_stream(sentences):
+                pos_taggings = tagger.pos_taggings(words, tags, entity_mark)
+                assert len(pos_taggings) == len(words)
+
+                sent_id = corpus.add_sentence(words, pos_taggings, fname)
+                for cand_idx, label in candidates:
+                    corpus.add_candidate(sent_id, cand_idx, label, trigger_idx)
+            cache.save_corpus(corpus)
+
+        self.corpus = corpus
+        # An instance is a candidate id of the corpus
+        self.instances = np.arange(corpus.num_candidates(), dtype=np.int32)
+
+        all_words, all_pos_taggings = set(corpus.words), set(corpus.pos_tags)
 
         all_words.add('<eos>')
         all_pos_taggings.add('*')
 
         self.word_id = dict(zip(all_words, range(len(all_words))))
         self.pos_taggings_id = dict(zip(all_pos_taggings, range(len(all_pos_taggings))))
-        self.mark_id = dict(zip(all_marks, range(len(all_marks))))
-        self.label_id = dict(zip(all_labels, range(len(all_labels))))
+        self.mark_id = {'A': 0, 'B': 1, 'T': 2}
+        self.label_id = corpus.label_id
 
         self.all_words = list(all_words)
         self.all_pos_taggings = list(all_pos_taggings)
-        self.all_labels = list(all_labels)
-        self.all_marks = list(all_marks)
+        self.all_labels = corpus.labels
+        self.all_marks = list(self.mark_id)
+        self.candidate_length = np.diff(corpus.token_offsets).astype(np.int32)[np.asarray(corpus.candidate_sentence)]
+        # Shorter batches are still padded to the widest convolution filter
+        self.min_sequence_length = max(HyperParams.filter_sizes)
 
     def shuffle(self):
-        np.random.shuffle(self.index)
+        self.epoch += 1
+        self.index = self.bucket(self.train_index.epoch_index(self.epoch))
         self.point = 0
 
+    def bucket(self, index):
+        '''
+        Same as Dataset_Trigger.bucket: batches are cut from length-sorted pools of the shuffled index.
+        '''
+        if not MyConfig.bucket_batches: return index
+        num_full = len(index) // self.batch_size * self.batch_size
+        rest, index = index[:len(index) - num_full], index[len(index) - num_full:]
+        lengths = self.candidate_length[np.asarray(self.train_instances, dtype=np.int64)[index]]
+        pool_size = self.batch_size * MyConfig.bucket_batches
+        pools = [index[start:start + pool_size][np.argsort(lengths[start:start + pool_size], kind='stable')]
+                 for start in range(0, len(index), pool_size)]
+        batches = np.concatenate(pools + [index[:0]]).reshape(-1, self.batch_size)
+        batches = batches[np.random.permutation(len(batches))]
+        return np.concatenate([batches.reshape(-1), rest])
+
     def next_batch(self):
         start = self.point
         self.point = self.point + self.batch_size
-        if self.point > len(self.train_instances):
+        if self.point > len(self.index):
             self.shuffle()
             start = 0
             self.point = self.point + self.batch_size
@@ -136,71 +170,49 @@ class Dataset:
         batch_instances = map(lambda x: self.train_instances[x], self.index[start:end])
         return batch_instances
 
-    def next_train_data(self):
-        batch_instances = self.next_batch()
+    def make_batch(self, batch_instances):
         pos_tag, y, x, t, c, pos_c, pos_t = [list() for _ in range(7)]
+        batch_instances = list(batch_instances)
+        length = self.max_sequence_length
+        if MyConfig.dynamic_padding:
+            length = max([self.candidate_length[ins] for ins in batch_instances] + [self.min_sequence_length])
 
         for instance in batch_instances:
-            words = instance['words']
-            pos_taggings = instance['pos_taggings']
-            marks = instance['marks']
-            label = instance['label']
-
-            index_candidates = find_candidates(marks, ['B'])
-            assert (len(index_candidates)) == 1
-            index_triggers = find_candidates(marks, ['T'])
-            # assert (len(index_triggers)) == 1
-            y.append(label)
-            marks = marks + ['A'] * (self.max_sequence_length - len(marks))
-            words = words + ['<eos>'] * (self.max_sequence_length - len(words))
-            pos_taggings = pos_taggings + ['*'] * (self.max_sequence_length - len(pos_taggings))
+            sent_id, index_candidate, index_trigger, label_id = self.corpus.candidate(instance)
+            words = self.corpus.sentence_words(sent_id)
+            pos_taggings = self.corpus.sentence_pos_taggings(sent_id)
+            y.append(label_id)
+            words = words + ['<eos>'] * (length - len(words))
+            pos_taggings = pos_taggings + ['*'] * (length - len(pos_taggings))
             pos_taggings = list(map(lambda x: self.pos_taggings_id[x], pos_taggings))
             pos_tag.append(pos_taggings)
             index_words = list(map(lambda x: self.word_id[x], words))
             x.append(index_words)
-            pos_candidate = [i for i in range(-index_candidates[0], 0)] + [i for i in range(0, self.max_sequence_length - index_candidates[0])]
+            pos_candidate = [i for i in range(-index_candidate, 0)] + [i for i in range(0, length - index_candidate)]
             pos_c.append(pos_candidate)
-            pos_trigger = [i for i in range(-index_triggers[0], 0)] + [i for i in range(0, self.max_sequence_length - index_triggers[0])]
+            pos_trigger = [i for i in range(-index_trigger, 0)] + [i for i in range(0, length - index_trigger)]
             pos_t.append(pos_trigger)
-            t.append([index_words[index_triggers[0]]] * self.max_sequence_length)
-            c.append([index_words[index_candidates[0]]] * self.max_sequence_length)
+            t.append([index_words[index_trigger]] * length)
+            c.append([index_words[index_candidate]] * length)
 
-            # print(len(words), len(marks), len(pos_taggings), len(index_words), len(pos_candidate), len(pos_trigger))
-            assert len(words) == len(marks) == len(pos_taggings) == len(index_words) == len(pos_candidate) == len(pos_trigger)
+            # print(len(words), len(pos_taggings), len(index_words), len(pos_candidate), len(pos_trigger))
+            assert len(words) == len(pos_taggings) == len(index_words) == len(pos_candidate) == len(pos_trigger)
         assert len(y) == len(x) == len(t) == len(c) == len(pos_c) == len(pos_t) == len(pos_tag)
-        return x, t, c, one_hot(y, self.label_id, len(self.all_labels)), pos_c, pos_t, pos_tag
+        return x, t, c, np.asarray(y, dtype=np.int32), pos_c, pos_t, pos_tag
 
-    def eval_data(self):
-        batch_instances = self.eval_instances
-        pos_tag, y, x, t, c, pos_c, pos_t = [list() for _ in range(7)]
-
-        for instance in batch_instances:
-            words = instance['words']
-            pos_taggings = instance['pos_taggings']
-            marks = instance['marks']
-            label = instance['label']
-            index_candidates = find_candidates(marks, ['B'])
-            assert (len(index_candidates)) == 1
-            index_triggers = find_candidates(marks, ['T'])
-            # assert (len(index_triggers)) == 1
-            y.append(label)
-            marks = marks + ['A'] * (self.max_sequence_length - len(marks))
-            words = words + ['<eos>'] * (self.max_sequence_length - len(words))
-            pos_taggings = pos_taggings + ['*'] * (self.max_sequence_length - len(pos_taggings))
-            pos_taggings = list(map(lambda x: self.pos_taggings_id[x], pos_taggings))
-            pos_tag.append(pos_taggings)
-            index_words = list(map(lambda x: self.word_id[x], words))
-            x.append(index_words)
-            pos_candidate = [i for i in range(-index_candidates[0], 0)] + [i for i in range(0, self.max_sequence_length - index_candidates[0])]
-            pos_c.append(pos_candidate)
-            pos_trigger = [i for i in range(-index_triggers[0], 0)] + [i for i in range(0, self.max_sequence_length - index_triggers[0])]
-            pos_t.append(pos_trigger)
-            t.append([index_words[index_triggers[0]]] * self.max_sequence_length)
-            c.append([index_words[index_candidates[0]]] * self.max_sequence_length)
-            assert len(words) == len(marks) == len(pos_taggings) == len(index_words) == len(pos_candidate) == len(pos_trigger)
-        assert len(y) == len(x) == len(t) == len(c) == len(pos_c) == len(pos_t) == len(
-            pos_tag)
-        return x, t, c, one_hot(y, self.label_id, len(self.all_labels)), pos_c, pos_t, pos_tag
+    def next_train_data(self):
+        return self.make_batch(self.next_batch())
+
+    def eval_batches(self, batch_size=None):
+        '''
+        The test split in batches of at most batch_size candidates (MyConfig.eval_batch_size by default).
+        '''
+        if batch_size is None: batch_size = MyConfig.eval_batch_size
+        instances = self.eval_instances
+        if MyConfig.dynamic_padding:
+            instances = instances[np.argsort(self.candidate_length[instances], kind='stable')]
+        for start in range(0, len(instances), batch_size):
+            yield self.make_batch(instances[start:start + batch_size])
 
 if __name__=='__main__':
     import pprint
@@ -0,0 +1,137 @@
+import os, json, time, shutil, hashlib, argparse, tempfile
+import numpy as np
+import nltk
+from Config import MyConfig
+from Corpus import Corpus, FORMAT_VERSION as CORPUS_FORMAT_VERSION
+
+"""
+Content-addressed cache of the built datasets. An entry is a directory <dataset_cache_path>/<name>-<key>/
+with the columnar corpus, the train/valid/test split of the trigger task as .npy arrays and meta.json.
+The key hashes every input the entry depends on: the corpus digest (contents of the ACE files and the
+preprocessing code), the config values used by the dataset and the source of the code that builds it.
+A change of any of them makes a new entry, stale entries are removed with
+
+    python DatasetCache.py list
+    python DatasetCache.py evict (ENTRY ... | --all | --older-than DAYS)
+"""
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def code_version(*fnames):
+    key = hashlib.sha1()
+    for fname in fnames:
+        with open(os.path.join(BASE_DIR, fname), 'rb') as f:
+            key.update(f.read())
+    return key.hexdigest()
+
+
+class DatasetCache():
+    def __init__(self, name, inputs):
+        self.root = MyConfig.dataset_cache_path
+        self.inputs = dict(inputs, corpus_format=CORPUS_FORMAT_VERSION, nltk=nltk.__version__)
+        self.key = hashlib.sha1(json.dumps(self.inputs, sort_keys=True).encode()).hexdigest()
+        self.name = name
+        self.path = os.path.join(self.root, '{}-{}'.format(name, self.key[:16]))
+        self.corpus_path = os.path.join(self.path, 'corpus')
+
+    def has_corpus(self):
+        return Corpus.exists(self.corpus_path)
+
+    def load_corpus(self):
+        self.touch()
+        return Corpus.load(self.corpus_path)
+
+    def save_corpus(self, corpus):
+        os.makedirs(self.path, exist_ok=True)
+        corpus.save(self.corpus_path)
+        # Written last, an entry with meta.json has its corpus
+        self.dump_file('meta.json', json.dumps({'name': self.name, 'key': self.key, 'inputs': self.inputs,
+                                                'created': time.time()}, indent=2).encode())
+
+    def has(self, fname):
+        return os.path.exists(os.path.join(self.path, fname))
+
+    def load_array(self, fname):
+        return np.load(os.path.join(self.path, fname), mmap_mode='r')
+
+    def save_array(self, fname, array):
+        self.dump_file(fname, lambda f: np.save(f, array))
+
+    def dump_file(self, fname, data):
+        '''
+        data: bytes, or a function writing the file content to the file object it is given.
+        '''
+        # Write to a temporary file of this run first, an interrupted run must not leave a broken entry behind.
+        os.makedirs(self.path, exist_ok=True)
+        fd, tmp_fname = tempfile.mkstemp(dir=self.path, prefix=fname + '.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            if callable(data):
+                data(f)
+            else:
+                f.write(data)
+        os.replace(tmp_fname, os.path.join(self.path, fname))
+
+    def touch(self):
+        # The last use of an entry is the mtime of its meta.json
+        meta_fname = os.path.join(self.path, 'meta.json')
+        if os.path.exists(meta_fname): os.utime(meta_fname)
+
+
+def list_entries(root=None):
+    if root is None: root = MyConfig.dataset_cache_path
+    if not os.path.isdir(root): return []
+    entries = []
+    for entry in sorted(os.listdir(root)):
+        path = os.path.join(root, entry)
+        if not os.path.isdir(path) or entry.endswith('.tmp'): continue
+        meta_fname = os.path.join(path, 'meta.json')
+        meta = dict()
+        if os.path.exists(meta_fname):
+            with open(meta_fname, 'r') as f:
+                meta = json.load(f)
+        size = sum(os.path.getsize(os.path.join(d, fname)) for d, _, fnames in os.walk(path) for fname in fnames)
+        last_used = os.path.getmtime(meta_fname if os.path.exists(meta_fname) else path)
+        # No meta.json: the build of the entry was interrupted or is still running
+        entries.append({'entry': entry, 'path': path, 'size': size, 'last_used': last_used, 'meta': meta,
+                        'complete': os.path.exists(meta_fname)})
+    return entries
+
+
+def evict(entries):
+    for entry in entries:
+        shutil.rmtree(entry['path'])
+        print('evicted {} ({:.1f}MB)'.format(entry['entry'], entry['size'] / 2 ** 20))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    subparsers.add_parser('list')
+    evict_parser = subparsers.add_parser('evict')
+    evict_parser.add_argument('entries', nargs='*', help='entry directory names, as printed by list')
+    evict_parser.add_argument('--all', action='store_true')
+    evict_parser.add_argument('--older-than', type=float, metavar='DAYS', help='not used for DAYS days')
+    args = parser.parse_args()
+
+    entries = list_entries()
+    if args.command == 'list':
+        for entry in entries:
+            inputs = entry['meta'].get('inputs', dict())
+            print('{}  {:8.1f}MB  last used {}  {}'.format(
+                entry['entry'], entry['size'] / 2 ** 20, time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['last_used'])),
+                ' '.join('{}={}'.format(k, v) for k, v in sorted(inputs.items()) if k in ['dtype', 'max_sequence_length', 'mark_long_entity_in_pos'])
+                if entry['complete'] else 'incomplete'))
+        print('{} entries, {:.1f}MB'.format(len(entries), sum(entry['size'] for entry in entries) / 2 ** 20))
+    else:
+        if args.all:
+            selected = entries
+        elif args.older_than is not None:
+            selected = [entry for entry in entries if time.time() - entry['last_used'] > args.older_than * 86400]
+        else:
+            if not args.entries: parser.error('give the entries to evict, --all or --older-than')
+            unknown = set(args.entries) - set(entry['entry'] for entry in entries)
+            if unknown: parser.error('no such entries: {}'.format(', '.join(sorted(unknown))))
+            selected = [entry for entry in entries if entry['entry'] in args.entries]
+        evict(selected)
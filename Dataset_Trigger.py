@@ -1,9 +1,11 @@
-import random
 import pickle, os
 import numpy as np
-import nltk
-from Util import one_hot, find_candidates
 from Config import MyConfig, HyperParams_Tri_classification
+from Corpus import Corpus
+from DatasetCache import DatasetCache, code_version
+from PosTagger import PosTagger
+from Glove import Glove
+from Sampler import TrainIndex
 
 
 class Dataset_Trigger:
@@ -21,11 +23,14 @@ class Dataset_Trigger:
         self.max_sequence_length = max_sequence_length
 
         self.dtype = dtype
+        self.corpus_digest = None
+        self.cache = None
 
         self.all_words = list()
         self.all_pos_taggings = list()
         self.all_marks = list()
         self.all_labels = list()
+        self.corpus = None
         self.instances = list()
 
         self.word_id = dict()
@@ -40,22 +45,29 @@ class Dataset_Trigger:
         print('complete')
 
         self.word_embed = self.embed_manager()
+        self.tensorize()
 
-        self.valid_instances, self.eval_instances, self.train_instances = [], [], []
         self.divide_train_valid_eval_data()
         print('\n\n########### TRAIN: {}   VALID: {}   TEST:   {}'.format(len(self.train_instances),
                                                                           len(self.valid_instances),
                                                                           len(self.eval_instances)))
 
-        # self.over_sampling()
-        self.batch_nums = len(self.train_instances) // self.batch_size
-        self.index = np.arange(len(self.train_instances))
+        self.train_ids = np.asarray(self.train_instances, dtype=np.int64)
+        # Positions of train_ids to train on, the instances are not copied
+        self.train_index = TrainIndex(self.candidate_label[self.train_ids], self.candidate_sentence[self.train_ids],
+                                      len(self.all_labels), self.label_id.get('None'), MyConfig.class_weights,
+                                      MyConfig.class_weight_cap, MyConfig.none_ratio, MyConfig.none_per_sentence,
+                                      MyConfig.none_seed)
+        self.epoch = 0
+        self.epoch_size = self.train_index.size
+        self.batch_nums = self.epoch_size // self.batch_size
+        self.index = self.bucket(self.train_index.epoch_index(self.epoch))
         self.point = 0
         print('all label for dataset: {}'.format(len(self.all_labels)))
 
     def embed_manager(self):
         matrix = np.zeros([len(self.all_words), HyperParams_Tri_classification.word_embedding_size])
-        word_map = self.read_glove()
+        glove = Glove()
 
         special_key_dump_fname = './data/special_key_emblen_{}.bin'.format(HyperParams_Tri_classification.word_embedding_size)
 
@@ -73,74 +85,26 @@ class Dataset_Trigger:
             with open(special_key_dump_fname,'wb') as f:
                 pickle.dump(dumped_skey, f)
 
-        for idx, word in enumerate(self.all_words):
-            if word in word_map.keys():
-                matrix[idx] = word_map[word]
-            else:
-                if len(word.split()) == 1:  # OOV case
-
-                    if word.lower() in word_map.keys():# even 'Did' is OOV!
-                        matrix[idx] = word_map[word.lower()]
-                    else:
-                        print('oov:   {}'.format(word))
-                        matrix[idx] = matrix[self.word_id['<unk>']]
-                else:  # multiple word as one word, maybe Entity case
-                    pass  # Do it after iterating all voca once
-
-        for idx, word in enumerate(self.all_words):
-            if word not in word_map.keys() and (len(word.split()) != 1):  ##Entity case
-                for subword in word.split():
-                    if subword in word_map:
-                        matrix[idx] += word_map[subword]
-                    else:
-                        matrix[idx] += matrix[self.word_id['<unk>']]
+        # Rows found in GloVe are gathered at once, only those rows are read from the memory-mapped matrix
+        glove_ids = glove.lookup(self.all_words)
+        found = glove_ids >= 0
+        matrix[found] = glove.vectors[glove_ids[found]]
+        unk_vec = matrix[self.word_id['<unk>']].copy()
+
+        # OOV case: the lowercase form (even 'Did' is OOV!), or the subwords of a multiple word as one word (maybe Entity case)
+        for idx in np.flatnonzero(~found):
+            rows = glove.resolve(self.all_words[idx])
+            if rows == [-1]: print('oov:   {}'.format(self.all_words[idx]))
+            matrix[idx] = glove.embed(rows, unk_vec)
         return matrix
 
-    @staticmethod
-    def read_glove():
-        word_map = dict()
-        with open(MyConfig.glove_txt_path, 'r', encoding='utf8') as f:
-            ls = f.readlines()
-            for l in ls:
-                l = l.split()
-                word_map[l[0]] = [float(el) for el in l[1:]]
-        return word_map
-
-    def over_sampling(self):
-        label_instance = dict()
-        for label in self.all_labels:
-            label_instance[label] = []
-
-        label_max_count = 0
-        for instance in self.train_instances:
-            label_instance[instance['label']].append(instance)
-        for label in label_instance:
-            if label_max_count < len(label_instance[label]): label_max_count = len(label_instance[label])
-
-        new_train_instances = []
-        for label in self.all_labels:
-            more = label_max_count - len(label_instance[label])
-            instances = label_instance[label]
-            for i in range(more):
-                instances.append(instances[i])
-            new_train_instances = new_train_instances + instances
-
-        print('label_max_count : ', label_max_count)
-        print('before_train_instances: ', len(self.train_instances))
-        print('new_train_instances :', len(new_train_instances))
-        self.train_instances = new_train_instances
-
-
     def divide_train_valid_eval_data(self):
-        tdv_instance_fname = './data/trigger_TDV_divide_{}_maxlen_{}_instance.bin'.format(self.dtype, HyperParams_Tri_classification.max_sequence_length)
-        train_ins, valid_ins, test_ins = [], [], []
-
-        if os.path.exists(tdv_instance_fname):
-            with open(tdv_instance_fname,'rb') as f:
-                train_ins,valid_ins,test_ins = pickle.load(f)
+        split_fnames = ['split_train.npy', 'split_valid.npy', 'split_test.npy']
+        if all(self.cache.has(fname) for fname in split_fnames):
+            train_ins, valid_ins, test_ins = [self.cache.load_array(fname) for fname in split_fnames]
         else:
-            validset_fname, testset_fname = [], []
-            random.shuffle(self.instances)
+            # Seeded, so the cache entries of every code version hold the same split of the same corpus
+            order = np.random.RandomState(MyConfig.split_seed).permutation(len(self.instances)).astype(np.int32)
             # select test set randomly
             # for ins in self.instances:
             #     if 'nw/adj' not in ins['fname']:
@@ -159,94 +123,64 @@ class Dataset_Trigger:
             #         test_ins.append(ins)
             #     else:
             #         raise ValueError
-            for ins in self.instances:
-                if ins['fname'] in testset_fname:
-                    test_ins.append(ins)
-                elif ins['fname'] in validset_fname:
-                    valid_ins.append(ins)
-                elif len(validset_fname)<35:
-                    validset_fname.append(ins['fname'])
-                    valid_ins.append(ins)
-                elif len(testset_fname)<35:
-                    testset_fname.append(ins['fname'])
-                    test_ins.append(ins)
-                else:
-                    train_ins.append(ins)
-            with open(tdv_instance_fname, 'wb') as f:
-                pickle.dump([train_ins, valid_ins, test_ins],f)
+            # In the shuffled order, the candidates of the first 35 files go to the valid set, of the next 35 files
+            # to the test set and the rest to the train set
+            fname_ids = np.asarray(self.corpus.sentence_fname)[np.asarray(self.corpus.candidate_sentence)[order]]
+            _, first = np.unique(fname_ids, return_index=True)
+            fname_rank = np.zeros(len(self.corpus.fnames), dtype=np.int64)
+            fname_rank[fname_ids[np.sort(first)]] = np.arange(len(first))
+            rank = fname_rank[fname_ids]
+            valid_ins, test_ins, train_ins = order[rank < 35], order[(rank >= 35) & (rank < 70)], order[rank >= 70]
+            for fname, ins in zip(split_fnames, [train_ins, valid_ins, test_ins]):
+                self.cache.save_array(fname, ins)
 
         self.train_instances, self.valid_instances, self.eval_instances = train_ins, valid_ins, test_ins
-        random.shuffle(self.train_instances)
         assert len(self.instances) == (len(self.train_instances) + len(self.eval_instances) + len(self.valid_instances))
 
-    def manage_entity_in_POS(self, poss, entity_mark):
-        new_pos = []
-        assert len(poss) == len(entity_mark)
-        for pos, ent in zip(poss, entity_mark):
-            if ent == '*':
-                new_pos.append(pos[1])
-            elif len(pos[0].split()) == 1:
-                new_pos.append(pos[1])
-            else:
-                new_pos.append('ENTITY')
-        return new_pos
-
     def read_dataset(self):
-        all_words, all_pos_taggings, all_labels, all_marks = [set() for _ in range(4)]
-
-        def read_one(words, marks, label, fname, entity_mark):
-            pos_taggings = nltk.pos_tag(words)
-            if MyConfig.mark_long_entity_in_pos:
-                pos_taggings = self.manage_entity_in_POS(pos_taggings, entity_mark)
-            # pos_taggings = [pos_tagging[1] for pos_tagging in pos_taggings]
-
-            assert len(pos_taggings) == len(words)
-
-            for word in words: all_words.add(word)
-            for mark in marks: all_marks.add(mark)
-            for pos_tag in pos_taggings: all_pos_taggings.add(pos_tag)
-            all_labels.add(label)
-
-            if len(words) > HyperParams_Tri_classification.max_sequence_length:
-                # print('len(word) > 80, Goodbye! ', len(words), words)
-                return None
-
-            res = {
-                'words': words,
-                'pos_taggings': pos_taggings,
-                'marks': marks,
-                'label': label,
-                'fname': fname
-            }
-            return res
-
         from Preprocess import PreprocessManager
         man = PreprocessManager()
-        man.preprocess(tasktype='TRIGGER', subtasktype=self.dtype)
-        tri_classification_data = man.tri_task_format_data
-
-        total_instance = []
-        dump_instance_fname = './data/trigger_{}_maxlen_{}_instance.bin'.format(self.dtype, HyperParams_Tri_classification.max_sequence_length)
-
-        if os.path.exists(dump_instance_fname):
-            print('use previous instance data for trigger task')
-            with open(dump_instance_fname, 'rb') as f:
-                total_instance = pickle.load(f)
-                for ins in total_instance:
-                    for word in ins['words']: all_words.add(word)
-                    for mark in ins['marks']: all_marks.add(mark)
-                    for pos_tag in ins['pos_taggings']: all_pos_taggings.add(pos_tag)
-                    all_labels.add(ins['label'])
+        # Nothing is parsed until the candidates are consumed.
+        documents = man.iter_documents()
+        tri_classification_data = man.iter_trigger_candidates(man.iter_sentences(documents), self.dtype)
+        self.corpus_digest = man.corpus_digest
+        # Everything the corpus and its split are made from
+        self.cache = DatasetCache('trigger_{}'.format(self.dtype.lower()), {
+            'corpus_digest': self.corpus_digest,
+            'dtype': self.dtype,
+            'max_sequence_length': HyperParams_Tri_classification.max_sequence_length,
+            'mark_long_entity_in_pos': MyConfig.mark_long_entity_in_pos,
+            # The split is kept in the entry
+            'split_seed': MyConfig.split_seed,
+            'code': code_version('Dataset_Trigger.py', 'Corpus.py', 'PosTagger.py'),
+        })
+
+        if self.cache.has_corpus():
+            print('use previous instance data for trigger task: {}'.format(self.cache.path))
+            corpus = self.cache.load_corpus()
         else:
-            print('Read {} data....'.format(len(tri_classification_data)))
-            for idx, data in enumerate(tri_classification_data):
-                if idx % 1000 == 0: print('{}/{}'.format(idx, len(tri_classification_data)))
-                res = read_one(words=data[0], marks=data[1], label=data[2], fname=data[3], entity_mark=data[4])
-                if res is not None: total_instance.append(res)
-            with open(dump_instance_fname, 'wb') as f:
-                pickle.dump(total_instance, f)
+            print('Read trigger data....')
+            # len(word) > max_sequence_length, Goodbye!
+            sentences = (data for data in tri_classification_data if len(data[0]) <= HyperParams_Tri_classification.max_sequence_length)
+            # One tagging per distinct sentence, shared by all of its candidates, a chunk of sentences at a time
+            tagger = PosTagger()
 
-        self.instances = total_instance
+            corpus = Corpus()
+            for idx, ((words, entity_mark, fname, candidates), tags) in enumerate(tagger.tag_stream(sentences)):
+                if idx % 1000 == 0: print(idx)
+                pos_taggings = tagger.pos_taggings(words, tags, entity_mark)
+                assert len(pos_taggings) == len(words)
+
+                sent_id = corpus.add_sentence(words, pos_taggings, fname)
+                for cand_idx, label in candidates:
+                    corpus.add_candidate(sent_id, cand_idx, label)
+            self.cache.save_corpus(corpus)
+
+        self.corpus = corpus
+        # An instance is a candidate id of the corpus
+        self.instances = np.arange(corpus.num_candidates(), dtype=np.int32)
+
+        all_words, all_pos_taggings = set(corpus.words), set(corpus.pos_tags)
 
         all_words.add('<eos>')
         all_words.add('<unk>')
@@ -257,118 +191,114 @@ class Dataset_Trigger:
         self.word_id = dict(zip(all_words, range(len(all_words))))
         for word in self.word_id: self.id2word[self.word_id[word]] = word
         self.pos_taggings_id = dict(zip(all_pos_taggings, range(len(all_pos_taggings))))
-        self.mark_id = dict(zip(all_marks, range(len(all_marks))))
-        self.label_id = dict(zip(all_labels, range(len(all_labels))))
+        self.mark_id = {'A': 0, 'B': 1}
+        self.label_id = corpus.label_id
         for label in self.label_id: self.id2label[self.label_id[label]] = label
 
         self.all_words = list(all_words)
         self.all_pos_taggings = list(all_pos_taggings)
-        self.all_labels = list(all_labels)
-        self.all_marks = list(all_marks)
+        self.all_labels = corpus.labels
+        self.all_marks = list(self.mark_id)
 
     def shuffle(self):
-        np.random.shuffle(self.index)
+        self.epoch += 1
+        self.index = self.bucket(self.train_index.epoch_index(self.epoch))
         self.point = 0
 
+    def bucket(self, index):
+        '''
+        Reorder the shuffled index so that each batch holds candidates of similar length: the index is cut into
+        pools of MyConfig.bucket_batches batches, every pool is sorted by length and split into batches, and the
+        batches are shuffled. The candidates left over from the full batches stay at the end.
+        '''
+        if not MyConfig.bucket_batches: return index
+        num_full = len(index) // self.batch_size * self.batch_size
+        rest, index = index[:len(index) - num_full], index[len(index) - num_full:]
+        lengths = self.candidate_length[self.train_ids[index]]
+        pool_size = self.batch_size * MyConfig.bucket_batches
+        pools = [index[start:start + pool_size][np.argsort(lengths[start:start + pool_size], kind='stable')]
+                 for start in range(0, len(index), pool_size)]
+        batches = np.concatenate(pools + [index[:0]]).reshape(-1, self.batch_size)
+        batches = batches[np.random.permutation(len(batches))]
+        return np.concatenate([batches.reshape(-1), rest])
+
     def next_batch(self):
         start = self.point
         self.point = self.point + self.batch_size
-        if self.point > len(self.train_instances):
+        if self.point > len(self.index):
             self.shuffle()
             start = 0
             self.point = self.point + self.batch_size
         end = self.point
-        batch_instances = map(lambda x: self.train_instances[x], self.index[start:end])
-        return batch_instances
+        return self.train_ids[self.index[start:end]]
+
+    def tensorize(self):
+        '''
+        Word and POS tag ids of every sentence padded to max_sequence_length, and the candidate columns,
+        as contiguous int32 arrays. Batches are fancy-indexed out of them.
+        '''
+        corpus = self.corpus
+        num_sentences = corpus.num_sentences()
+
+        def pad(ids, offsets, pad_id):
+            lengths = np.diff(offsets)
+            assert lengths.max(initial=0) <= self.max_sequence_length
+            res = np.full([num_sentences, self.max_sequence_length], pad_id, dtype=np.int32)
+            rows = np.repeat(np.arange(num_sentences), lengths)
+            cols = np.arange(len(ids)) - np.repeat(offsets[:-1], lengths)
+            res[rows, cols] = ids
+            return res
+
+        word_ids = np.asarray([self.word_id[word] for word in corpus.words], dtype=np.int32)
+        pos_ids = np.asarray([self.pos_taggings_id[pos_tag] for pos_tag in corpus.pos_tags], dtype=np.int32)
+        self.sentence_x = pad(word_ids[corpus.tokens], corpus.token_offsets, self.word_id['<eos>'])
+        self.sentence_pos_tag = pad(pos_ids[corpus.pos], corpus.pos_offsets, self.pos_taggings_id['*'])
+        self.candidate_sentence = np.asarray(corpus.candidate_sentence, dtype=np.int32)
+        self.candidate_index = np.asarray(corpus.candidate_index, dtype=np.int32)
+        self.candidate_label = np.asarray(corpus.candidate_label, dtype=np.int32)
+        self.relative_pos = np.arange(self.max_sequence_length, dtype=np.int32)
+        self.candidate_length = np.diff(corpus.token_offsets).astype(np.int32)[self.candidate_sentence]
+        # Shorter batches are still padded to the widest convolution filter
+        self.min_sequence_length = max(HyperParams_Tri_classification.filter_sizes)
+
+    def make_batch(self, batch_instances):
+        ids = np.asarray(batch_instances, dtype=np.int64)
+        sentences = self.candidate_sentence[ids]
+        index_candidates = self.candidate_index[ids]
+        length = self.batch_length(ids)
+
+        x = self.sentence_x[sentences, :length]
+        pos_tag = self.sentence_pos_tag[sentences, :length]
+        pos_c = self.relative_pos[None, :length] - index_candidates[:, None]
+        c = np.repeat(x[np.arange(len(ids)), index_candidates][:, None], length, axis=1)
+        y = self.candidate_label[ids]
+        return x, c, y, pos_c, pos_tag
+
+    def batch_length(self, ids):
+        if not MyConfig.dynamic_padding: return self.max_sequence_length
+        return max(self.candidate_length[ids].max(initial=0), self.min_sequence_length)
 
     def next_train_data(self):
-        batch_instances = self.next_batch()
-        pos_tag, y, x, c, pos_c = [list() for _ in range(5)]
-
-        for instance in batch_instances:
-            words = instance['words']
-            pos_taggings = instance['pos_taggings']
-            marks = instance['marks']
-            label = instance['label']
-
-            index_candidates = find_candidates(marks, ['B'])
-            assert (len(index_candidates)) == 1
-
-            y.append(label)
-            marks = marks + ['A'] * (self.max_sequence_length - len(marks))
-            words = words + ['<eos>'] * (self.max_sequence_length - len(words))
-            pos_taggings = pos_taggings + ['*'] * (self.max_sequence_length - len(pos_taggings))
-            pos_taggings = list(map(lambda x: self.pos_taggings_id[x], pos_taggings))
-            pos_tag.append(pos_taggings)
-            index_words = list(map(lambda x: self.word_id[x], words))
-            x.append(index_words)
-            pos_candidate = [i for i in range(-index_candidates[0], 0)] + [i for i in range(0, self.max_sequence_length - index_candidates[0])]
-            pos_c.append(pos_candidate)
-            c.append([index_words[index_candidates[0]]] * self.max_sequence_length)
-            assert len(words) == len(marks) == len(pos_taggings) == len(index_words) == len(pos_candidate)
-
-        assert len(y) == len(x) == len(c) == len(pos_c) == len(pos_tag)
-        return x, c, one_hot(y, self.label_id, len(self.all_labels)), pos_c, pos_tag
-
-    def next_eval_data(self):
-        batch_instances = self.eval_instances
-        pos_tag, y, x, c, pos_c = [list() for _ in range(5)]
-
-        for instance in batch_instances:
-            words = instance['words']
-            pos_taggings = instance['pos_taggings']
-            marks = instance['marks']
-            label = instance['label']
-
-            index_candidates = find_candidates(marks, ['B'])
-            assert (len(index_candidates)) == 1
-
-            y.append(label)
-            marks = marks + ['A'] * (self.max_sequence_length - len(marks))
-            words = words + ['<eos>'] * (self.max_sequence_length - len(words))
-            pos_taggings = pos_taggings + ['*'] * (self.max_sequence_length - len(pos_taggings))
-            pos_taggings = list(map(lambda x: self.pos_taggings_id[x], pos_taggings))
-            pos_tag.append(pos_taggings)
-            index_words = list(map(lambda x: self.word_id[x], words))
-            x.append(index_words)
-            pos_candidate = [i for i in range(-index_candidates[0], 0)] + [i for i in range(0,
-                                                                                            self.max_sequence_length -
-                                                                                            index_candidates[0])]
-            pos_c.append(pos_candidate)
-            c.append([index_words[index_candidates[0]]] * self.max_sequence_length)
-            assert len(words) == len(marks) == len(pos_taggings) == len(index_words) == len(pos_candidate)
-        assert len(y) == len(x) == len(c) == len(pos_c) == len(pos_tag)
-        return x, c, one_hot(y, self.label_id, len(self.all_labels)), pos_c, pos_tag
-
-    def next_valid_data(self):
-        batch_instances = self.valid_instances
-        pos_tag, y, x, c, pos_c = [list() for _ in range(5)]
-
-        for instance in batch_instances:
-            words = instance['words']
-            pos_taggings = instance['pos_taggings']
-            marks = instance['marks']
-            label = instance['label']
-
-            index_candidates = find_candidates(marks, ['B'])
-            assert (len(index_candidates)) == 1
-
-            y.append(label)
-            marks = marks + ['A'] * (self.max_sequence_length - len(marks))
-            words = words + ['<eos>'] * (self.max_sequence_length - len(words))
-            pos_taggings = pos_taggings + ['*'] * (self.max_sequence_length - len(pos_taggings))
-            pos_taggings = list(map(lambda x: self.pos_taggings_id[x], pos_taggings))
-            pos_tag.append(pos_taggings)
-            index_words = list(map(lambda x: self.word_id[x], words))
-            x.append(index_words)
-            pos_candidate = [i for i in range(-index_candidates[0], 0)] + [i for i in range(0,
-                                                                                            self.max_sequence_length -
-                                                                                            index_candidates[0])]
-            pos_c.append(pos_candidate)
-            c.append([index_words[index_candidates[0]]] * self.max_sequence_length)
-            assert len(words) == len(marks) == len(pos_taggings) == len(index_words) == len(pos_candidate)
-        assert len(y) == len(x) == len(c) == len(pos_c) == len(pos_tag)
-        return x, c, one_hot(y, self.label_id, len(self.all_labels)), pos_c, pos_tag
+        return self.make_batch(self.next_batch())
+
+    def iter_batches(self, instances, batch_size=None):
+        '''
+        Batches of at most batch_size candidates (MyConfig.eval_batch_size by default), so a whole split is
+        evaluated without building it as one batch. With dynamic padding they are taken in order of length.
+        '''
+        if batch_size is None: batch_size = MyConfig.eval_batch_size
+        if MyConfig.dynamic_padding:
+            # Candidates of similar length share a batch
+            instances = np.asarray(instances, dtype=np.int64)
+            instances = instances[np.argsort(self.candidate_length[instances], kind='stable')]
+        for start in range(0, len(instances), batch_size):
+            yield self.make_batch(instances[start:start + batch_size])
+
+    def eval_batches(self, batch_size=None):
+        return self.iter_batches(self.eval_instances, batch_size)
+
+    def valid_batches(self, batch_size=None):
+        return self.iter_batches(self.valid_instances, batch_size)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,132 @@
+import os, json, time, functools
+import numpy as np
+from Config import MyConfig
+
+"""
+Binary copy of the GloVe text file: a float32 .npy matrix with one row per word and the words in the
+same order. The text file is converted once, after that the matrix is memory-mapped, so only the rows
+that are looked up are ever read, and processes serving the same file share its pages.
+"""
+
+
+class Glove():
+    def __init__(self, txt_path=None):
+        self.txt_path = MyConfig.glove_txt_path if txt_path is None else txt_path
+        name = os.path.splitext(os.path.basename(self.txt_path))[0]
+        self.vectors_fname = os.path.join(MyConfig.glove_cache_path, name + '.npy')
+        self.words_fname = os.path.join(MyConfig.glove_cache_path, name + '.words.txt')
+        self.source_fname = os.path.join(MyConfig.glove_cache_path, name + '.json')
+
+        if not self.is_converted(): self.convert()
+        self.vectors = np.load(self.vectors_fname, mmap_mode='r')
+        with open(self.words_fname, 'r', encoding='utf8') as f:
+            self.words = f.read().split('\n')
+        # Like the former word_map dict, a word listed twice gets its last row
+        self.word_id = dict(zip(self.words, range(len(self.words))))
+
+    def source_stamp(self):
+        stat = os.stat(self.txt_path)
+        return {'path': os.path.abspath(self.txt_path), 'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+    def is_converted(self):
+        if not os.path.exists(self.source_fname): return False
+        with open(self.source_fname, 'r') as f:
+            return json.load(f) == self.source_stamp()
+
+    def convert(self):
+        print('convert {} to {}'.format(self.txt_path, self.vectors_fname))
+        os.makedirs(MyConfig.glove_cache_path, exist_ok=True)
+        num_words, dim = 0, None
+        with open(self.txt_path, 'r', encoding='utf8') as f:
+            for l in f:
+                if dim is None: dim = len(l.split()) - 1
+                num_words += 1
+
+        # The matrix is filled in place on disk, the text file is never held in memory
+        vectors = np.lib.format.open_memmap(self.vectors_fname + '.tmp', mode='w+', dtype=np.float32, shape=(num_words, dim))
+        words = []
+        with open(self.txt_path, 'r', encoding='utf8') as f:
+            for idx, l in enumerate(f):
+                l = l.split()
+                words.append(l[0])
+                vectors[idx] = np.asarray(l[1:], dtype=np.float32)
+        vectors.flush()
+        del vectors
+        with open(self.words_fname + '.tmp', 'w', encoding='utf8') as f:
+            f.write('\n'.join(words))
+
+        # The stamp goes last, an interrupted conversion is started over
+        os.replace(self.vectors_fname + '.tmp', self.vectors_fname)
+        os.replace(self.words_fname + '.tmp', self.words_fname)
+        with open(self.source_fname, 'w') as f:
+            json.dump(self.source_stamp(), f)
+
+    def lookup(self, words):
+        '''
+        Row of every word in the matrix, -1 when it is not in GloVe.
+        '''
+        return np.asarray([self.word_id.get(word, -1) for word in words], dtype=np.int64)
+
+    def resolve(self, word):
+        '''
+        Rows whose sum embeds word, with the rules of Dataset_Trigger.embed_manager: the word itself,
+        else its lowercase form for a single word, else the sum of its subwords. -1 stands for <unk>.
+        '''
+        if word in self.word_id: return [self.word_id[word]]
+        subwords = word.split()
+        if len(subwords) == 1: return [self.word_id.get(word.lower(), -1)]
+        return [self.word_id.get(subword, -1) for subword in subwords]
+
+    def embed(self, rows, unk_vec):
+        vec = np.zeros(self.vectors.shape[1])
+        for row in rows:
+            vec += self.vectors[row] if row >= 0 else unk_vec
+        return vec
+
+    def __contains__(self, word):
+        return word in self.word_id
+
+    def __getitem__(self, word):
+        return self.vectors[self.word_id[word]]
+
+
+class GloveEmbedder():
+    '''
+    Embeds the words of a sentence at inference time. Words of the training vocabulary get their row of the
+    trained embedding matrix, the others are looked up lazily in the full GloVe matrix; their vectors are
+    kept in an LRU cache.
+    '''
+    def __init__(self, word_embed, word_id, glove=None, cache_size=None):
+        if cache_size is None: cache_size = MyConfig.glove_lru_size
+        self.word_embed = word_embed
+        self.word_id = word_id
+        self.glove = Glove() if glove is None else glove
+        self.unk_vec = np.asarray(word_embed[word_id['<unk>']])
+        self.embed_unseen = functools.lru_cache(maxsize=cache_size)(self.embed_unseen_word)
+
+    def embed_unseen_word(self, word):
+        return self.glove.embed(self.glove.resolve(word), self.unk_vec)
+
+    def embed_words(self, words):
+        vecs = [self.word_embed[self.word_id[word]] if word in self.word_id else self.embed_unseen(word) for word in words]
+        return np.asarray(vecs, dtype=np.float32)
+
+
+if __name__ == '__main__':
+    # Startup time of the text file against the converted matrix
+    start = time.time()
+    word_map = dict()
+    with open(MyConfig.glove_txt_path, 'r', encoding='utf8') as f:
+        for l in f.readlines():
+            l = l.split()
+            word_map[l[0]] = [float(el) for el in l[1:]]
+    text_time = time.time() - start
+
+    Glove()  # converts on the first run
+    start = time.time()
+    glove = Glove()
+    binary_time = time.time() - start
+
+    same = all(np.allclose(glove[word], vec) for word, vec in word_map.items())
+    print('words: {}  same vectors: {}'.format(len(glove.words), same))
+    print('text: {:.2f}s  binary: {:.2f}s  ({:.1f}x)'.format(text_time, binary_time, text_time / max(binary_time, 1e-9)))
@@ -0,0 +1,216 @@
+import time
+import numpy as np
+import tensorflow as tf
+
+"""
+Layers shared by Model.py and Model_Trigger.py. Run it to check the model variants against each other and for a
+throughput benchmark of them.
+"""
+
+
+def dynamic_multi_pooling(h, segments, num_segments):
+    '''
+    Dynamic multi-pooling of DMCNN (Chen et al. 2015): the max of every filter over each segment of the
+    sentence instead of over the whole sentence. h: [batch_size, length, filter_num] feature maps after ReLU,
+    segments: [batch_size, length] segment of every position, in [0, num_segments).
+    Returns [batch_size, num_segments * filter_num], an empty segment pools to 0.
+    '''
+    # Masking by multiplication is enough since h >= 0
+    mask = tf.one_hot(segments, num_segments, dtype=h.dtype)
+    pooled = tf.reduce_max(tf.expand_dims(h, 2) * tf.expand_dims(mask, 3), axis=1)
+    return tf.reshape(pooled, [-1, num_segments * h.shape.as_list()[-1]])
+
+
+def sentence_lengths(input_x, pad_word_id):
+    '''
+    Number of words of each row of input_x up to its last word that is not padding.
+    '''
+    not_pad = tf.cast(tf.not_equal(input_x, pad_word_id), tf.int32)
+    return tf.reduce_max(not_pad * tf.range(1, tf.shape(input_x)[1] + 1), axis=1)
+
+
+def mask_padding(h, lengths, filter_size):
+    '''
+    Zero the feature maps h [batch_size, conv_length, 1, filter_num] of the windows that end in the padding, so
+    the pooled features do not depend on the width a batch is padded to. The first window is always kept, a
+    sentence shorter than the filter still has its features. h >= 0 after ReLU, a zero never wins the max.
+    '''
+    num_windows = tf.maximum(lengths - filter_size + 1, 1)
+    mask = tf.sequence_mask(num_windows, tf.shape(h)[1], dtype=h.dtype)
+    return h * mask[:, :, None, None]
+
+
+def candidate_segments(c_pos, t_pos=None):
+    '''
+    Segment of every position from the distance vectors: split after the candidate, or into before / between /
+    after the trigger and the candidate when t_pos is given.
+    '''
+    segments = tf.cast(c_pos > 0, tf.int32)
+    if t_pos is not None: segments += tf.cast(t_pos > 0, tf.int32)
+    return segments
+
+
+CONV_ENCODERS = ['conv2d', 'conv1d', 'fused']
+
+
+def conv1d_feature_maps(inputs, conv_weights, filter_sizes, fused=False, activation=True):
+    '''
+    The VALID convolutions of every filter size followed by their ReLU, on inputs [batch_size, length, dim]
+    without the 4-D single channel layout of conv2d. conv_weights are the (W, b) of the conv2d graph, W of shape
+    [filter_size, dim, 1, filter_num], so checkpoints of that graph are restored as they are.
+    fused: all filter sizes as one matmul over the unfolded windows of max(filter_sizes) words, instead of a
+    conv1d per filter size. The fused path does more multiply-adds; the separate conv1d per filter size is faster
+    on CPU.
+    activation: False returns the linear convolutions, without b (which may be None) and the ReLU.
+    Returns the feature maps [batch_size, length - filter_size + 1, filter_num] of every filter size.
+    '''
+    if not fused:
+        convs = [tf.nn.conv1d(inputs, tf.squeeze(W, 2), 1, 'VALID') for W, _ in conv_weights]
+        if not activation: return convs
+        return [tf.nn.relu(conv + b) for conv, (_, b) in zip(convs, conv_weights)]
+
+    max_size = max(filter_sizes)
+    dim = inputs.shape.as_list()[-1]
+    batch_size, length = tf.shape(inputs)[0], tf.shape(inputs)[1]
+    padded = tf.pad(inputs, [[0, 0], [0, max_size - 1], [0, 0]])
+    # [batch_size, length, max_size * dim], the max_size words starting at every position
+    windows = tf.concat([padded[:, i:i + length] for i in range(max_size)], 2)
+    # The kernels of the smaller filters get zero rows for the words they do not cover
+    kernel = tf.concat([tf.pad(tf.reshape(W, [size * dim, -1]), [[0, (max_size - size) * dim], [0, 0]])
+                        for (W, _), size in zip(conv_weights, filter_sizes)], 1)
+    h = tf.matmul(tf.reshape(windows, [-1, max_size * dim]), kernel)
+    if activation: h = tf.nn.relu(h + tf.concat([b for _, b in conv_weights], 0))
+    h = tf.reshape(h, [batch_size, length, -1])
+    # Only the windows inside the sentence are outputs of the VALID convolution
+    h = tf.split(h, [W.shape.as_list()[-1] for W, _ in conv_weights], axis=2)
+    return [h_i[:, :length - size + 1] for h_i, size in zip(h, filter_sizes)]
+
+
+LEXICAL_FEATURES = ['sentence', 'window']
+
+
+def window_features(word_vec, pad_vec, centers, windows, rows=None):
+    '''
+    Lexical features of DMCNN: the embeddings of the 2 * windows + 1 words around each center, flattened.
+    word_vec: [num_sentences, length, dim], pad_vec: [dim] embedding of the words outside the sentence,
+    centers: [batch_size] token index of the center word in its sentence, rows: [batch_size] row of each center
+    in word_vec, by default the i-th center is in the i-th sentence.
+    Returns [batch_size, (2 * windows + 1) * dim].
+    '''
+    dim = word_vec.shape.as_list()[-1]
+    if rows is None: rows = tf.range(tf.shape(centers)[0])
+    pad = tf.tile(tf.reshape(pad_vec, [1, 1, dim]), [tf.shape(word_vec)[0], windows, 1])
+    padded = tf.concat([pad, word_vec, pad], 1)
+    # Word center + k is at center + k + windows of padded
+    positions = tf.expand_dims(centers, 1) + tf.range(2 * windows + 1)
+    rows = tf.tile(tf.expand_dims(rows, 1), [1, 2 * windows + 1])
+    window = tf.gather_nd(padded, tf.stack([rows, positions], 2))
+    return tf.reshape(window, [-1, (2 * windows + 1) * dim])
+
+
+if __name__ == '__main__':
+    # The conv1d and fused feature maps against conv2d with the same weights
+    rs = np.random.RandomState(0)
+    filter_sizes, dim, filter_num = [3, 4, 5], 110, 64
+    inputs = rs.randn(16, 30, dim).astype(np.float32)
+    conv_weights = [(rs.randn(size, dim, 1, filter_num).astype(np.float32) * 0.1, rs.randn(filter_num).astype(np.float32))
+                    for size in filter_sizes]
+    with tf.Graph().as_default(), tf.Session() as sess:
+        inputs_ph = tf.placeholder(tf.float32, [None, None, dim])
+        weights = [(tf.constant(W), tf.constant(b)) for W, b in conv_weights]
+        conv2d = [tf.squeeze(tf.nn.relu(tf.nn.conv2d(tf.expand_dims(inputs_ph, -1), W, [1, 1, 1, 1], 'VALID') + b), 2)
+                  for W, b in weights]
+        ref = sess.run(conv2d, {inputs_ph: inputs})
+        for encoder in ['conv1d', 'fused']:
+            h = sess.run(conv1d_feature_maps(inputs_ph, weights, filter_sizes, fused=encoder == 'fused'), {inputs_ph: inputs})
+            diff = max(abs(r - h_i).max() for r, h_i in zip(ref, h))
+            print('{} max abs difference to conv2d: {:.2g}'.format(encoder, diff))
+            assert diff < 1e-4
+
+    from Config import HyperParams_Tri_classification as hp_trigger, HyperParams as hp_argument
+    from Model_Trigger import Model as TriggerModel
+    from Model import Model as ArgumentModel
+
+    # A sentence gets the same scores whatever width its batch is padded to
+    L, vocab_size, pad_word_id = 30, 50, 0
+    x = np.zeros([1, L], dtype=np.int32)
+    x[0, :9] = rs.randint(1, vocab_size, 9)
+    c_pos, t_pos = np.arange(L)[None] - 4, np.arange(L)[None] - 7
+    for Model in [TriggerModel, ArgumentModel]:
+        for multi_pooling in [False, True]:
+            with tf.Graph().as_default(), tf.Session() as sess:
+                tf.set_random_seed(0)
+                model = Model(sentence_length=L, num_labels=3, vocab_size=vocab_size, filter_num=16, sparse_labels=True,
+                              pad_word_id=pad_word_id, multi_pooling=multi_pooling)
+                sess.run(tf.global_variables_initializer())
+                scores = []
+                for width in [12, L]:
+                    feed_dict = {model.input_x: x[:, :width], model.input_c_pos: c_pos[:, :width], model.dropout_keep_prob: 1.0}
+                    if hasattr(model, 'input_t_pos'): feed_dict[model.input_t_pos] = t_pos[:, :width]
+                    scores.append(sess.run(model.scores, feed_dict))
+            diff = abs(scores[0] - scores[1]).max()
+            print('{} multi_pooling={} scores at widths 12 and {}: max abs difference {:.2g}'.format(
+                Model.__module__, multi_pooling, L, diff))
+            assert diff < 1e-4
+
+    # The multi_candidate graph of Model_Trigger, with the same weights, scores every candidate as the pair graph
+    lengths = [9, 14, 5]
+    x = np.zeros([len(lengths), max(lengths)], dtype=np.int32)
+    for i, length in enumerate(lengths): x[i, :length] = rs.randint(1, vocab_size, length)
+    c_sentence = np.repeat(np.arange(len(lengths)), lengths).astype(np.int32)
+    c_index = np.concatenate([np.arange(length) for length in lengths]).astype(np.int32)
+    c_pos = np.arange(x.shape[1])[None] - c_index[:, None]
+    for conv_encoder in CONV_ENCODERS:
+        for multi_pooling in [False, True]:
+            for lexical_features in LEXICAL_FEATURES:
+                kwargs = dict(sentence_length=L, num_labels=3, vocab_size=vocab_size, filter_num=16, sparse_labels=True,
+                              pad_word_id=pad_word_id, multi_pooling=multi_pooling, conv_encoder=conv_encoder,
+                              lexical_features=lexical_features)
+                with tf.Graph().as_default(), tf.Session() as sess:
+                    model = TriggerModel(**kwargs)
+                    sess.run(tf.global_variables_initializer())
+                    weights = sess.run(tf.global_variables())
+                    pair_scores = sess.run(model.scores, {model.input_x: x[c_sentence], model.input_c_pos: c_pos,
+                                                          model.dropout_keep_prob: 1.0})
+                with tf.Graph().as_default(), tf.Session() as sess:
+                    model = TriggerModel(multi_candidate=True, **kwargs)
+                    # Both graphs make the same variables in the same order
+                    for variable, value in zip(tf.global_variables(), weights): variable.load(value, sess)
+                    multi_scores = sess.run(model.scores, {model.input_x: x, model.input_c_sentence: c_sentence,
+                                                           model.input_c_index: c_index, model.dropout_keep_prob: 1.0})
+                diff = abs(pair_scores - multi_scores).max()
+                print('multi_candidate {} multi_pooling={} {} lexical features: max abs difference {:.2g}'.format(
+                    conv_encoder, multi_pooling, lexical_features, diff))
+                assert diff < 1e-4
+
+    # Training and inference throughput of the conv2d / max-pool graph against its variants
+
+    variants = [('conv2d max-pooling', dict()), ('dynamic multi-pooling', dict(multi_pooling=True)),
+                ('conv1d', dict(conv_encoder='conv1d')), ('fused', dict(conv_encoder='fused')),
+                ('conv1d window lexical', dict(conv_encoder='conv1d', lexical_features='window'))]
+    rs = np.random.RandomState(0)
+    num_steps, vocab_size = 50, 5000
+    for name, Model, hp in [('trigger', TriggerModel, hp_trigger), ('argument', ArgumentModel, hp_argument)]:
+        L = hp.max_sequence_length
+        x = rs.randint(0, vocab_size, [hp.batch_size, L])
+        c_pos = np.arange(L)[None] - rs.randint(0, L, [hp.batch_size, 1])
+        t_pos = np.arange(L)[None] - rs.randint(0, L, [hp.batch_size, 1])
+        y = rs.randint(0, 2, hp.batch_size)
+        for variant, kwargs in variants:
+            with tf.Graph().as_default():
+                model = Model(sentence_length=L, num_labels=2, vocab_size=vocab_size,
+                              word_embedding_size=hp.word_embedding_size, pos_embedding_size=hp.pos_embedding_size,
+                              filter_sizes=hp.filter_sizes, filter_num=hp.filter_num, sparse_labels=True, **kwargs)
+                train_op = tf.train.AdamOptimizer(hp.lr).minimize(model.loss)
+                sess = tf.Session()
+                sess.run(tf.global_variables_initializer())
+                feed_dict = {model.input_x: x, model.input_y: y, model.input_c_pos: c_pos, model.dropout_keep_prob: 0.5}
+                if hasattr(model, 'input_t_pos'): feed_dict[model.input_t_pos] = t_pos
+                speeds = []
+                for fetch in [train_op, model.scores]:
+                    sess.run(fetch, feed_dict)
+                    start = time.time()
+                    for _ in range(num_steps):
+                        sess.run(fetch, feed_dict)
+                    speeds.append(num_steps * hp.batch_size / (time.time() - start))
+                print('{} {}: train {:.0f} examples/s, inference {:.0f} examples/s'.format(name, variant, *speeds))
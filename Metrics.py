@@ -0,0 +1,97 @@
+import numpy as np
+
+"""
+Streaming evaluation metrics. The confusion matrix is updated one batch at a time, so the memory used by an
+evaluation does not depend on the size of the split. Precision, recall and F1 follow
+sklearn.metrics.precision_recall_fscore_support: the averages are taken over the labels that occur in the
+true or the predicted labels, and an undefined ratio counts as 0.
+"""
+
+
+class ConfusionMatrix():
+    def __init__(self, num_labels):
+        self.num_labels = num_labels
+        # [true label, predicted label]
+        self.matrix = np.zeros([num_labels, num_labels], dtype=np.int64)
+
+    def update(self, y_true, y_pred):
+        y_true = np.asarray(y_true, dtype=np.int64)
+        y_pred = np.asarray(y_pred, dtype=np.int64)
+        counts = np.bincount(y_true * self.num_labels + y_pred, minlength=self.num_labels ** 2)
+        self.matrix += counts.reshape(self.num_labels, self.num_labels)
+
+    def total(self):
+        return int(self.matrix.sum())
+
+    def accuracy(self):
+        return np.trace(self.matrix) / max(self.total(), 1)
+
+    def per_label(self):
+        '''
+        Precision, recall, F1 and support of every label.
+        '''
+        tp = np.diag(self.matrix).astype(np.float64)
+        support = self.matrix.sum(axis=1)
+        predicted = self.matrix.sum(axis=0)
+        precision = safe_divide(tp, predicted)
+        recall = safe_divide(tp, support)
+        f1 = safe_divide(2 * precision * recall, precision + recall)
+        return precision, recall, f1, support
+
+    def prf(self, average):
+        '''
+        Precision, recall and F1 averaged as 'micro', 'macro' or 'weighted'.
+        '''
+        precision, recall, f1, support = self.per_label()
+        seen = (support + self.matrix.sum(axis=0)) > 0
+        if average == 'micro':
+            tp = np.trace(self.matrix)
+            p = r = safe_divide(tp, self.total())
+            return p, r, safe_divide(2 * p * r, p + r)
+        if average == 'macro':
+            weights = seen.astype(np.float64)
+        elif average == 'weighted':
+            weights = support.astype(np.float64)
+        else:
+            raise ValueError('unknown average: {}'.format(average))
+        if weights.sum() == 0: return 0., 0., 0.
+        return tuple(float(np.average(m, weights=weights)) for m in [precision, recall, f1])
+
+    def report(self, target_names, digits=2):
+        '''
+        Text in the layout of sklearn.metrics.classification_report.
+        '''
+        precision, recall, f1, support = self.per_label()
+        width = max(max(len(name) for name in target_names), len('weighted avg'), digits)
+        head_fmt = '{:>{width}s} ' + ' {:>9}' * 4
+        row_fmt = '{:>{width}s} ' + ' {:>9.{digits}f}' * 3 + ' {:>9}'
+        lines = [head_fmt.format('', 'precision', 'recall', 'f1-score', 'support', width=width), '']
+        for i, name in enumerate(target_names):
+            lines.append(row_fmt.format(name, precision[i], recall[i], f1[i], support[i], width=width, digits=digits))
+        lines.append('')
+        acc_fmt = '{:>{width}s} ' + ' {:>9}' * 2 + ' {:>9.{digits}f} {:>9}'
+        lines.append(acc_fmt.format('accuracy', '', '', self.accuracy(), self.total(), width=width, digits=digits))
+        for average in ['macro', 'weighted']:
+            lines.append(row_fmt.format(average + ' avg', *self.prf(average), self.total(), width=width, digits=digits))
+        return '\n'.join(lines) + '\n'
+
+
+def safe_divide(a, b):
+    a, b = np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64)
+    res = np.divide(a, b, out=np.zeros(np.broadcast(a, b).shape), where=b != 0)
+    return res if res.ndim else float(res)
+
+
+if __name__ == '__main__':
+    # Compare against sklearn on random labels streamed in chunks
+    from sklearn.metrics import classification_report, precision_recall_fscore_support as prf_score
+    rng = np.random.RandomState(0)
+    y_true, y_pred = rng.randint(0, 5, 10000), rng.randint(0, 4, 10000)
+    cm = ConfusionMatrix(5)
+    for i in range(0, len(y_true), 512):
+        cm.update(y_true[i:i + 512], y_pred[i:i + 512])
+    for average in ['micro', 'macro', 'weighted']:
+        print(average, np.allclose(cm.prf(average), prf_score(y_true, y_pred, average=average)[:3]))
+    print(cm.report(['a', 'b', 'c', 'd', 'e']))
+    # scikit-learn 0.21 has no zero_division keyword, it reports the undefined scores as 0 with a warning
+    print(classification_report(y_true, y_pred, target_names=['a', 'b', 'c', 'd', 'e']))
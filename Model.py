@@ -1,6 +1,8 @@
 import time, datetime, os
 import tensorflow as tf
 from Dataset import Dataset
+from Layers import dynamic_multi_pooling, candidate_segments, sentence_lengths, mask_padding, conv1d_feature_maps, CONV_ENCODERS, \
+    window_features, LEXICAL_FEATURES
 import numpy as np
 
 from Config import HyperParams as hp
@@ -20,7 +22,12 @@ class Model():
                  pos_embedding_size=10,
                  filter_sizes=[3, 4, 5],
                  filter_num=200,
-                 embed_matrx=None
+                 embed_matrx=None,
+                 sparse_labels=False,
+                 pad_word_id=0,
+                 multi_pooling=False,
+                 conv_encoder='conv2d',
+                 lexical_features='sentence'
                  ):
 
         tf_version_checker = int(tf.__version__.split('.')[0])
@@ -28,22 +35,35 @@ class Model():
         """
         :param sentence_length
         :param num_labels
-        :param windows
+        :param windows: words on each side of the trigger and the candidate in the 'window' lexical features
         :param vocab_size
         :param word_embedding_size
         :param pos_embedding_size
         :param filter_sizes
         :param filter_num
+        :param sparse_labels: input_y holds label ids instead of one-hot vectors
+        :param pad_word_id: id of the padding word, batches may be padded to any length up to sentence_length
+        :param multi_pooling: dynamic multi-pooling, each feature map is pooled before, between and after the
+                              trigger and the candidate
+        :param conv_encoder: 'conv2d', or 'conv1d' / 'fused' for Layers.conv1d_feature_maps
+        :param lexical_features: 'sentence' flattens the embeddings of all sentence_length words, 'window' takes
+                                 the words around the trigger and the candidate (Layers.window_features)
         """
-        input_x = tf.placeholder(tf.int32, shape=[None, sentence_length], name="input_x")
+        # Feed of the variables initializer, nothing to feed here
+        self.init_feed_dict = dict()
+        # [batch_size, batch_length], batch_length <= sentence_length
+        input_x = tf.placeholder(tf.int32, shape=[None, None], name="input_x")
         self.input_x = input_x
-        input_y = tf.placeholder(tf.float32, shape=[None, num_labels], name="input_y")
+        if sparse_labels:
+            input_y = tf.placeholder(tf.int32, shape=[None], name="input_y")
+        else:
+            input_y = tf.placeholder(tf.float32, shape=[None, num_labels], name="input_y")
         self.input_y = input_y
         # trigger distance vector
-        input_t_pos = tf.placeholder(tf.int32, shape=[None, sentence_length], name="input_t_pos")
+        input_t_pos = tf.placeholder(tf.int32, shape=[None, None], name="input_t_pos")
         self.input_t_pos = input_t_pos
         # argument candidates distance vector
-        input_c_pos = tf.placeholder(tf.int32, shape=[None, sentence_length], name="input_c_pos")
+        input_c_pos = tf.placeholder(tf.int32, shape=[None, None], name="input_c_pos")
         self.input_c_pos = input_c_pos
         dropout_keep_prob = tf.placeholder(tf.float32, name="dropout_keep_prob")
         self.dropout_keep_prob = dropout_keep_prob
@@ -52,6 +72,15 @@ class Model():
             W_text = tf.Variable(tf.random_normal(shape=[vocab_size, word_embedding_size], mean=0.0, stddev=0.5), name="word_table")
 
             input_word_vec = tf.nn.embedding_lookup(W_text, input_x)
+            assert lexical_features in LEXICAL_FEATURES
+            if lexical_features == 'sentence':
+                # The lexical features keep sentence_length words, the rest of the batch is padded here
+                num_pad = sentence_length - tf.shape(input_x)[1]
+                pad_word_vec = tf.nn.embedding_lookup(W_text, tf.fill([tf.shape(input_x)[0], num_pad], pad_word_id))
+                if tf_version_checker >= 1:
+                    lexical_word_vec = tf.concat([input_word_vec, pad_word_vec], 1)
+                else:
+                    lexical_word_vec = tf.concat(1, [input_word_vec, pad_word_vec])
             input_t_pos_t = input_t_pos + (sentence_length - 1)
             Tri_pos = tf.Variable(
                 tf.random_normal(shape=[2 * (sentence_length - 1) + 1, pos_embedding_size], mean=0.0, stddev=0.5),
@@ -69,35 +98,66 @@ class Model():
                 input_sentence_vec = tf.concat(2, [input_word_vec, input_t_pos_vec, input_c_pos_vec])
             # CNN supports 4d input, so increase the one-dimensional vector to indicate the number of input channels.
             input_sentence_vec_expanded = tf.expand_dims(input_sentence_vec, -1)
-        pooled_outputs = []
+        # Pooled segments of every feature map
+        num_segments = 3 if multi_pooling else 1
+        assert conv_encoder in CONV_ENCODERS
+        conv_scopes, conv_weights = [], []
         for i, filter_size in enumerate(filter_sizes):
-            with tf.name_scope('conv-maxpool-%s' % filter_size):
+            with tf.name_scope('conv-maxpool-%s' % filter_size) as scope:
                 # The current word and context of the sentence feature considered here
                 filter_shape = [filter_size, word_embedding_size + 2 * pos_embedding_size, 1, filter_num]
                 W = tf.Variable(tf.truncated_normal(filter_shape, stddev=0.1), name="W")
                 b = tf.Variable(tf.constant(0.1, shape=[filter_num]), name="b")
-                conv = tf.nn.conv2d(
-                    input_sentence_vec_expanded,
-                    W,
-                    strides=[1, 1, 1, 1],
-                    padding="VALID",
-                    name="conv")
-                h = tf.nn.relu(tf.nn.bias_add(conv, b), name="relu")
-                pooled = tf.nn.max_pool(
-                    h,
-                    ksize=[1, sentence_length - filter_size + 1, 1, 1],
-                    strides=[1, 1, 1, 1],
-                    padding='VALID',
-                    name="pool")
+                conv_scopes.append(scope)
+                conv_weights.append((W, b))
+        use_conv1d = conv_encoder != 'conv2d'
+        if use_conv1d:
+            # Same variables, on the [batch_size, length, dim] input
+            with tf.name_scope('conv-%s' % conv_encoder):
+                conv1d_h = conv1d_feature_maps(input_sentence_vec, conv_weights, filter_sizes, fused=conv_encoder == 'fused')
+        # Words of each sentence before its padding
+        lengths = sentence_lengths(input_x, pad_word_id)
+        pooled_outputs = []
+        for i, filter_size in enumerate(filter_sizes):
+            W, b = conv_weights[i]
+            with tf.name_scope(conv_scopes[i]):
+                if use_conv1d:
+                    h = tf.expand_dims(conv1d_h[i], 2, name="relu")
+                else:
+                    conv = tf.nn.conv2d(
+                        input_sentence_vec_expanded,
+                        W,
+                        strides=[1, 1, 1, 1],
+                        padding="VALID",
+                        name="conv")
+                    h = tf.nn.relu(tf.nn.bias_add(conv, b), name="relu")
+                h = mask_padding(h, lengths, filter_size)
+                if multi_pooling:
+                    conv_length = tf.shape(h)[1]
+                    segments = candidate_segments(input_c_pos[:, :conv_length], input_t_pos[:, :conv_length])
+                    pooled = dynamic_multi_pooling(tf.squeeze(h, 2), segments, num_segments)
+                    pooled = tf.reshape(pooled, [-1, 1, 1, num_segments * filter_num], name="pool")
+                else:
+                    # Max over the batch length, the windows in the padding are 0
+                    pooled = tf.reduce_max(h, axis=1, keepdims=True, name="pool")
                 pooled_outputs.append(pooled)
 
-        num_filters_total = filter_num * len(filter_sizes)
+        num_filters_total = filter_num * len(filter_sizes) * num_segments
         if tf_version_checker >= 1:
             h_pool = tf.concat(pooled_outputs, 3)
         else:
             h_pool = tf.concat(3, pooled_outputs)
         h_pool_flat = tf.reshape(h_pool, [-1, num_filters_total])
-        lexical_vec = tf.reshape(input_word_vec, shape=(-1, sentence_length * word_embedding_size))
+        if lexical_features == 'window':
+            # The trigger and the candidate are the words at distance 0, the distance of the first word is minus
+            # their index
+            pad_vec = tf.nn.embedding_lookup(W_text, pad_word_id)
+            lexical_vec = tf.concat([window_features(input_word_vec, pad_vec, -input_t_pos[:, 0], windows),
+                                     window_features(input_word_vec, pad_vec, -input_c_pos[:, 0], windows)], 1)
+            lexical_size = 2 * (2 * windows + 1) * word_embedding_size
+        else:
+            lexical_vec = tf.reshape(lexical_word_vec, shape=(-1, sentence_length * word_embedding_size))
+            lexical_size = sentence_length * word_embedding_size
         # Combine lexical level features and sentence level features
         if tf_version_checker >= 1:
             all_input_features = tf.concat([lexical_vec, h_pool_flat], 1)
@@ -110,7 +170,7 @@ class Model():
 
         #with tf.device('/cpu:0'), tf.name_scope('softmax'):
         with tf.name_scope('softmax'):
-            W = tf.Variable(tf.truncated_normal([num_filters_total + sentence_length * word_embedding_size, num_labels], stddev=0.1), name="W")
+            W = tf.Variable(tf.truncated_normal([num_filters_total + lexical_size, num_labels], stddev=0.1), name="W")
             b = tf.Variable(tf.constant(0.1, shape=[num_labels]), name="b")
             scores = tf.nn.xw_plus_b(all_features, W, b, name="scores")
             predicts = tf.arg_max(scores, dimension=1, name="predicts")
@@ -119,7 +179,12 @@ class Model():
 
         #with tf.device('/cpu:0'), tf.name_scope('loss'):
         with tf.name_scope('loss'):
-            if tf_version_checker >= 1:
+            if sparse_labels:
+                if tf_version_checker >= 1:
+                    entropy = tf.nn.sparse_softmax_cross_entropy_with_logits(labels=input_y, logits=scores)
+                else:
+                    entropy = tf.nn.sparse_softmax_cross_entropy_with_logits(scores, input_y)
+            elif tf_version_checker >= 1:
                 entropy = tf.nn.softmax_cross_entropy_with_logits(labels=input_y, logits=scores)
             else:
                 entropy = tf.nn.softmax_cross_entropy_with_logits(scores, input_y)
@@ -128,7 +193,8 @@ class Model():
 
         #with tf.device('/cpu:0'), tf.name_scope("accuracy"):
         with tf.name_scope("accuracy"):
-            correct = tf.equal(predicts, tf.argmax(input_y, 1))
+            labels = tf.cast(input_y, tf.int64) if sparse_labels else tf.argmax(input_y, 1)
+            correct = tf.equal(predicts, labels)
             accuracy = tf.reduce_mean(tf.cast(correct, "float"), name="accuracy")
             self.accuracy = accuracy
 
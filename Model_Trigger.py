@@ -3,6 +3,8 @@ import time, datetime, os
 import tensorflow as tf
 from sklearn.metrics import classification_report, precision_score, recall_score, accuracy_score
 from Dataset_Trigger import Dataset_Trigger as Dataset
+from Layers import dynamic_multi_pooling, candidate_segments, sentence_lengths, mask_padding, conv1d_feature_maps, CONV_ENCODERS, \
+    window_features, LEXICAL_FEATURES
 
 from Config import HyperParams_Tri_classification as hp
 
@@ -24,7 +26,13 @@ class Model():
                  filter_sizes=[3, 4, 5],
                  filter_num=200,
                  batch_size=10,
-                 embed_matrx=None
+                 embed_matrx=None,
+                 sparse_labels=False,
+                 pad_word_id=0,
+                 multi_candidate=False,
+                 multi_pooling=False,
+                 conv_encoder='conv2d',
+                 lexical_features='sentence'
                  ):
 
         tf_version_checker = int(tf.__version__.split('.')[0])
@@ -32,21 +40,36 @@ class Model():
         """
         :param sentence_length
         :param num_labels
-        :param windows
+        :param windows: words on each side of the candidate in the 'window' lexical features
         :param vocab_size
         :param word_embedding_size
         :param pos_embedding_size
         :param filter_sizes
         :param filter_num
+        :param sparse_labels: input_y holds label ids instead of one-hot vectors
+        :param pad_word_id: id of the padding word, batches may be padded to any length up to sentence_length
+        :param multi_candidate: input_x holds sentences and input_c_sentence / input_c_index the candidates to score,
+                                the word convolution runs once per sentence. Same variables as the default graph.
+        :param multi_pooling: dynamic multi-pooling, each feature map is pooled before and after the candidate
+        :param conv_encoder: 'conv2d', or 'conv1d' / 'fused' for Layers.conv1d_feature_maps
+        :param lexical_features: 'sentence' flattens the embeddings of all sentence_length words, 'window' takes
+                                 the words around the candidate (Layers.window_features)
         """
 
+        # Feed of tf.global_variables_initializer(), holds the pre-trained word embedding
+        self.init_feed_dict = dict()
+
         # TODO: Check whether batch size can determined arbitrary in <1.0.0 version.
         batch_size = None
-        # [batch_size, sentence_length]
-        input_x = tf.placeholder(tf.int32, shape=[batch_size, sentence_length], name="input_x")
+        # [batch_size, batch_length], batch_length <= sentence_length
+        input_x = tf.placeholder(tf.int32, shape=[batch_size, None], name="input_x")
         self.input_x = input_x
-        # [batch_size, num_labels]
-        input_y = tf.placeholder(tf.float32, shape=[batch_size, num_labels], name="input_y")
+        if sparse_labels:
+            # [batch_size]
+            input_y = tf.placeholder(tf.int32, shape=[batch_size], name="input_y")
+        else:
+            # [batch_size, num_labels]
+            input_y = tf.placeholder(tf.float32, shape=[batch_size, num_labels], name="input_y")
         self.input_y = input_y
 
         # input_y_weights = tf.placeholder(tf.float32, shape=[batch_size], name="input_y_weights")
@@ -54,10 +77,17 @@ class Model():
         # input_pos_tag = tf.placeholder(tf.int32, shape=[batch_size, sentence_length], name="input_pos_tag")
         # self.input_pos_tag = input_pos_tag
 
-        # argument candidates distance vector
-        # example: [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19]
-        input_c_pos = tf.placeholder(tf.int32, shape=[batch_size, sentence_length], name="input_c_pos")
-        self.input_c_pos = input_c_pos
+        if multi_candidate:
+            # [num_candidates] row of the candidate's sentence in input_x and its token index
+            input_c_sentence = tf.placeholder(tf.int32, shape=[None], name="input_c_sentence")
+            input_c_index = tf.placeholder(tf.int32, shape=[None], name="input_c_index")
+            self.input_c_sentence, self.input_c_index = input_c_sentence, input_c_index
+            self.input_c_pos = None
+        else:
+            # argument candidates distance vector
+            # example: [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19]
+            input_c_pos = tf.placeholder(tf.int32, shape=[batch_size, None], name="input_c_pos")
+            self.input_c_pos = input_c_pos
 
         dropout_keep_prob = tf.placeholder(tf.float32, name="dropout_keep_prob")
         self.dropout_keep_prob = dropout_keep_prob
@@ -69,67 +99,146 @@ class Model():
             if embed_matrx is None:  # use randomly initialized matrix as word embedding
                 W_text = tf.Variable(tf.random_normal(shape=[vocab_size, word_embedding_size], mean=0.0, stddev=0.5), name="word_table")
             else:  # pre-trained word embedding matrix
-                W_text = tf.Variable(embed_matrx, trainable=False, dtype=tf.float32, name='word_embedding')
-            input_word_vec = tf.nn.embedding_lookup(W_text, input_x)
+                # Fed to the initializer, a constant initial value would put the whole matrix in the GraphDef
+                embed_init = tf.placeholder(tf.float32, shape=np.shape(embed_matrx), name='word_embedding_init')
+                W_text = tf.Variable(embed_init, trainable=False, name='word_embedding')
+                self.init_feed_dict[embed_init] = embed_matrx
+            # Named so that serving can feed the word vectors directly
+            input_word_vec = tf.identity(tf.nn.embedding_lookup(W_text, input_x), name='input_word_vec')
+            assert lexical_features in LEXICAL_FEATURES
+            if lexical_features == 'sentence':
+                # The lexical features keep sentence_length words, the rest of the batch is padded here
+                num_pad = sentence_length - tf.shape(input_word_vec)[1]
+                pad_word_vec = tf.nn.embedding_lookup(W_text, tf.fill([tf.shape(input_word_vec)[0], num_pad], pad_word_id))
+                lexical_word_vec = tf.concat([input_word_vec, pad_word_vec], 1)
 
             # Pos_tag = tf.Variable(
             #     tf.random_normal(shape=[pos_tag_max_size, pos_embedding_size], mean=0.0, stddev=0.5),
             #     name="input_pos_tag_table")
             # input_pos_tag_vec = tf.nn.embedding_lookup(Pos_tag, input_pos_tag)
 
-            input_c_pos_c = input_c_pos + (sentence_length - 1)
             Can_pos = tf.Variable(
                 tf.random_normal(shape=[2 * (sentence_length - 1) + 1, pos_embedding_size], mean=0.0, stddev=0.5),
                 name="candidate_pos_table")
-            input_c_pos_vec = tf.nn.embedding_lookup(Can_pos, input_c_pos_c)
+            if multi_candidate:
+                input_word_vec_expanded = tf.expand_dims(input_word_vec, -1)
+                # The whole position table as one sequence, [1, 2 * (sentence_length - 1) + 1, pos_embedding_size, 1]
+                can_pos_expanded = tf.expand_dims(tf.expand_dims(Can_pos, 0), -1)
+                # Row of the position table at the first word: the distance 0 - index + (sentence_length - 1)
+                c_pos_start = (sentence_length - 1) - input_c_index
+            else:
+                input_c_pos_c = input_c_pos + (sentence_length - 1)
+                input_c_pos_vec = tf.nn.embedding_lookup(Can_pos, input_c_pos_c)
 
-            # The feature of the distance and the word features of the sentence constitute a collated feature as an input to the convolutional neural network.
-            # [batch_size, sentence_length, word_embedding_size+2*pos_size]
+                # The feature of the distance and the word features of the sentence constitute a collated feature as an input to the convolutional neural network.
+                # [batch_size, sentence_length, word_embedding_size+2*pos_size]
 
-            # [input_word_vec, input_c_pos_vec, input_pos_tag_vec]
-            input_sentence_vec = tf.concat([input_word_vec, input_c_pos_vec], 2)
-            # CNN supports 4d input, so increase the one-dimensional vector to indicate the number of input channels.
-            input_sentence_vec_expanded = tf.expand_dims(input_sentence_vec, -1)
-        pooled_outputs = []
+                # [input_word_vec, input_c_pos_vec, input_pos_tag_vec]
+                input_sentence_vec = tf.concat([input_word_vec, input_c_pos_vec], 2)
+                # CNN supports 4d input, so increase the one-dimensional vector to indicate the number of input channels.
+                input_sentence_vec_expanded = tf.expand_dims(input_sentence_vec, -1)
+        # Pooled segments of every feature map
+        num_segments = 2 if multi_pooling else 1
+        assert conv_encoder in CONV_ENCODERS
+        conv_scopes, conv_weights = [], []
         for i, filter_size in enumerate(filter_sizes):
-            with tf.name_scope('conv-maxpool-%s' % filter_size):
+            with tf.name_scope('conv-maxpool-%s' % filter_size) as scope:
                 # The current word and context of the sentence feature considered here
                 # when using pos_tag: [filter_size, word_embedding_size +  2 * pos_embedding_size, 1, filter_num]
                 filter_shape = [filter_size, word_embedding_size +  pos_embedding_size, 1, filter_num]
                 W = tf.Variable(tf.truncated_normal(filter_shape, stddev=0.1), name="W")
                 b = tf.Variable(tf.constant(0.1, shape=[filter_num]), name="b")
-                # Convolution operation
-                conv = tf.nn.conv2d(
-                    input_sentence_vec_expanded,
-                    W,
-                    strides=[1, 1, 1, 1],
-                    padding="VALID",
-                    name="conv")
-                h = tf.nn.relu(tf.nn.bias_add(conv, b), name="relu")
-                # Maximize pooling
-                pooled = tf.nn.max_pool(
-                    h,
-                    ksize=[1, sentence_length - filter_size + 1, 1, 1],
-                    strides=[1, 1, 1, 1],
-                    padding='VALID',
-                    name="pool")
+                conv_scopes.append(scope)
+                conv_weights.append((W, b))
+        use_conv1d = conv_encoder != 'conv2d'
+        if use_conv1d:
+            # Same variables, on the [batch_size, length, dim] input
+            fused = conv_encoder == 'fused'
+            with tf.name_scope('conv-%s' % conv_encoder):
+                if multi_candidate:
+                    word_kernels = [(W[:, :word_embedding_size], None) for W, _ in conv_weights]
+                    pos_kernels = [(W[:, word_embedding_size:], None) for W, _ in conv_weights]
+                    conv1d_word = conv1d_feature_maps(input_word_vec, word_kernels, filter_sizes, fused, activation=False)
+                    conv1d_pos = conv1d_feature_maps(tf.expand_dims(Can_pos, 0), pos_kernels, filter_sizes, fused,
+                                                     activation=False)
+                else:
+                    conv1d_h = conv1d_feature_maps(input_sentence_vec, conv_weights, filter_sizes, fused=fused)
+        # Words of each sentence before its padding
+        lengths = sentence_lengths(input_x, pad_word_id)
+        if multi_candidate: lengths = tf.gather(lengths, input_c_sentence)
+        pooled_outputs = []
+        for i, filter_size in enumerate(filter_sizes):
+            W, b = conv_weights[i]
+            with tf.name_scope(conv_scopes[i]):
+                if multi_candidate:
+                    # The convolution is linear in its input channels: the word rows of W are applied once per
+                    # sentence, the position rows once to the position table, for every possible distance
+                    if use_conv1d:
+                        word_conv, pos_conv = conv1d_word[i], conv1d_pos[i]
+                    else:
+                        word_conv = tf.nn.conv2d(input_word_vec_expanded, W[:, :word_embedding_size],
+                                                 strides=[1, 1, 1, 1], padding="VALID", name="word_conv")
+                        pos_conv = tf.nn.conv2d(can_pos_expanded, W[:, word_embedding_size:],
+                                                strides=[1, 1, 1, 1], padding="VALID", name="pos_conv")
+                        word_conv = tf.squeeze(word_conv, 2)
+                    # [num_sentences, conv_length, filter_num] and [num_distances, filter_num]
+                    pos_conv = tf.reshape(pos_conv, [-1, filter_num])
+                    # Output t of a candidate at index k covers the distances starting at t - k
+                    pos_rows = tf.range(tf.shape(word_conv)[1])[None, :] + c_pos_start[:, None]
+                    conv = tf.gather(word_conv, input_c_sentence) + tf.gather(pos_conv, pos_rows)
+                    conv = tf.expand_dims(conv, 2, name="conv")
+                    h = tf.nn.relu(tf.nn.bias_add(conv, b), name="relu")
+                elif use_conv1d:
+                    h = tf.expand_dims(conv1d_h[i], 2, name="relu")
+                else:
+                    # Convolution operation
+                    conv = tf.nn.conv2d(
+                        input_sentence_vec_expanded,
+                        W,
+                        strides=[1, 1, 1, 1],
+                        padding="VALID",
+                        name="conv")
+                    h = tf.nn.relu(tf.nn.bias_add(conv, b), name="relu")
+                h = mask_padding(h, lengths, filter_size)
+                if multi_pooling:
+                    conv_length = tf.shape(h)[1]
+                    if multi_candidate:
+                        c_pos = tf.range(conv_length)[None, :] - input_c_index[:, None]
+                    else:
+                        c_pos = input_c_pos[:, :conv_length]
+                    pooled = dynamic_multi_pooling(tf.squeeze(h, 2), candidate_segments(c_pos), num_segments)
+                    pooled = tf.reshape(pooled, [-1, 1, 1, num_segments * filter_num], name="pool")
+                else:
+                    # Maximize pooling over the batch length, the windows in the padding are 0
+                    pooled = tf.reduce_max(h, axis=1, keepdims=True, name="pool")
                 pooled_outputs.append(pooled)
 
-        num_filters_total = filter_num * len(filter_sizes)
+        num_filters_total = filter_num * len(filter_sizes) * num_segments
         # The number of all filters used (number of channels output)
         h_pool = tf.concat(pooled_outputs, 3)
         # Expand to the next level classifier
         h_pool_flat = tf.reshape(h_pool, [-1, num_filters_total])
-        lexical_vec = tf.reshape(input_word_vec, shape=(-1, sentence_length * word_embedding_size))
+        if lexical_features == 'window':
+            pad_vec = tf.nn.embedding_lookup(W_text, pad_word_id)
+            if multi_candidate:
+                lexical_vec = window_features(input_word_vec, pad_vec, input_c_index, windows, input_c_sentence)
+            else:
+                # The candidate is the word at distance 0, c_pos of the first word is minus its index
+                lexical_vec = window_features(input_word_vec, pad_vec, -input_c_pos[:, 0], windows)
+            lexical_size = (2 * windows + 1) * word_embedding_size
+        else:
+            lexical_vec = tf.reshape(lexical_word_vec, shape=(-1, sentence_length * word_embedding_size))
+            if multi_candidate: lexical_vec = tf.gather(lexical_vec, input_c_sentence)
+            lexical_size = sentence_length * word_embedding_size
         # Combine lexical level features and sentence level features
-        # [batch_size, num_filters_total] + [batch_size, sentence_length*word_embedding_size]
+        # [batch_size, num_filters_total] + [batch_size, lexical_size]
         all_input_features = tf.concat([lexical_vec, h_pool_flat], 1)
         # The overall classifier goes through a layer of dropout and then into softmax
         with tf.device('/cpu:0'), tf.name_scope('dropout'):
             all_features = tf.nn.dropout(all_input_features, dropout_keep_prob)
 
         with tf.name_scope('output'):
-            W = tf.Variable(tf.truncated_normal([num_filters_total + sentence_length * word_embedding_size, num_labels], stddev=0.1), name="W")
+            W = tf.Variable(tf.truncated_normal([num_filters_total + lexical_size, num_labels], stddev=0.1), name="W")
             b = tf.Variable(tf.constant(0.1, shape=[num_labels]), name="b")
             scores = tf.nn.xw_plus_b(all_features, W, b, name="scores")
             predicts = tf.arg_max(scores, dimension=1, name="predicts")
@@ -137,11 +246,15 @@ class Model():
             self.predicts = predicts
 
         with tf.name_scope('loss'):
-            entropy = tf.nn.softmax_cross_entropy_with_logits(labels=input_y, logits=scores)
+            if sparse_labels:
+                entropy = tf.nn.sparse_softmax_cross_entropy_with_logits(labels=input_y, logits=scores)
+            else:
+                entropy = tf.nn.softmax_cross_entropy_with_logits(labels=input_y, logits=scores)
             loss = tf.reduce_mean(entropy)
             self.loss = loss
 
         with tf.name_scope("accuracy"):
-            correct = tf.equal(predicts, tf.argmax(input_y, 1))
+            labels = tf.cast(input_y, tf.int64) if sparse_labels else tf.argmax(input_y, 1)
+            correct = tf.equal(predicts, labels)
             accuracy = tf.reduce_mean(tf.cast(correct, "float"), name="accuracy")
             self.accuracy = accuracy
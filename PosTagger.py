@@ -0,0 +1,116 @@
+import os, pickle, multiprocessing, itertools
+import nltk
+from Config import MyConfig
+
+"""
+POS tags for the dataset sentences. Every distinct token sequence is tagged once, in a process pool
+when MyConfig.pos_tag_workers > 1, and the tags are kept in a persistent cache keyed by the token
+sequence, so a rebuild only tags the sentences it has not seen before. tag_stream tags a stream of
+sentences in bounded chunks, so a dataset build does not hold all of its sentences.
+"""
+
+CHUNK_SIZE = 256  # sentences per pool task
+
+
+def tag_sentences(sentences):
+    return [[tag for _, tag in tagged] for tagged in nltk.pos_tag_sents(sentences)]
+
+
+class PosTagger():
+    def __init__(self, num_workers=None):
+        if num_workers is None: num_workers = MyConfig.pos_tag_workers
+        self.num_workers = num_workers
+        cache_path = MyConfig.pos_tag_cache_path
+        # The tags depend on the tagger, a new nltk version gets a new cache file
+        self.cache_fname = None if cache_path is None else os.path.join(cache_path, 'pos_tags_nltk_{}.bin'.format(nltk.__version__))
+        self.cache = self.load_cache()
+        self.modified = False
+        # Worker pool kept for the chunks of a tag_stream, started when a chunk first has sentences to tag
+        self.keep_pool = False
+        self.pool = None
+
+    def load_cache(self):
+        if self.cache_fname is None or not os.path.exists(self.cache_fname): return dict()
+        with open(self.cache_fname, 'rb') as f:
+            return pickle.load(f)
+
+    def dump_cache(self):
+        if self.cache_fname is None: return
+        os.makedirs(os.path.dirname(self.cache_fname), exist_ok=True)
+        with open(self.cache_fname + '.tmp', 'wb') as f:
+            pickle.dump(self.cache, f)
+        os.replace(self.cache_fname + '.tmp', self.cache_fname)
+
+    def save(self):
+        if self.modified: self.dump_cache()
+        self.modified = False
+
+    def tag(self, sentences, save=True):
+        '''
+        Return the tags of every sentence (a list of words), only the unseen token sequences are tagged.
+        save: write the new tags to the cache file now, tag_stream saves once at the end instead.
+        '''
+        keys = [tuple(words) for words in sentences]
+        missing = list(dict.fromkeys(key for key in keys if key not in self.cache))
+        print('POS tagging: {} sentences, {} to tag'.format(len(keys), len(missing)))
+        if missing:
+            for key, tags in zip(missing, self.tag_missing(missing)):
+                self.cache[key] = tags
+            self.modified = True
+        if save: self.save()
+        return [self.cache[key] for key in keys]
+
+    def tag_stream(self, records, chunk_size=None):
+        '''
+        Yield (record, tags) for records whose first item is the words of a sentence, reading and tagging
+        chunk_size records at a time.
+        '''
+        if chunk_size is None: chunk_size = MyConfig.pos_tag_chunk_size
+        records = iter(records)
+        self.keep_pool = True
+        try:
+            while True:
+                chunk = list(itertools.islice(records, chunk_size))
+                if not chunk: break
+                for record, tags in zip(chunk, self.tag([record[0] for record in chunk], save=False)):
+                    yield record, tags
+            self.save()
+        finally:
+            self.keep_pool = False
+            self.close_pool()
+
+    def close_pool(self):
+        if self.pool is None: return
+        self.pool.close()
+        self.pool.join()
+        self.pool = None
+
+    def tag_missing(self, sentences):
+        sentences = [list(words) for words in sentences]
+        if self.num_workers <= 1 or len(sentences) <= CHUNK_SIZE:
+            return tag_sentences(sentences)
+        chunks = [sentences[i:i + CHUNK_SIZE] for i in range(0, len(sentences), CHUNK_SIZE)]
+        if self.keep_pool:
+            if self.pool is None: self.pool = multiprocessing.Pool(self.num_workers)
+            return [tags for chunk_tags in self.pool.map(tag_sentences, chunks) for tags in chunk_tags]
+        with multiprocessing.Pool(self.num_workers) as pool:
+            return [tags for chunk_tags in pool.map(tag_sentences, chunks) for tags in chunk_tags]
+
+    @staticmethod
+    def manage_entity_in_POS(poss, entity_mark):
+        # poss: (word, tag) pairs. Multi-word entities are tagged 'ENTITY'.
+        new_pos = []
+        assert len(poss) == len(entity_mark)
+        for pos, ent in zip(poss, entity_mark):
+            if ent == '*':
+                new_pos.append(pos[1])
+            elif len(pos[0].split()) == 1:
+                new_pos.append(pos[1])
+            else:
+                new_pos.append('ENTITY')
+        return new_pos
+
+    def pos_taggings(self, words, tags, entity_mark):
+        if MyConfig.mark_long_entity_in_pos:
+            return self.manage_entity_in_POS(list(zip(words, tags)), entity_mark)
+        return tags
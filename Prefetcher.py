@@ -0,0 +1,82 @@
+import threading, queue, time
+
+"""
+Background input pipeline for training. A thread builds the next batches into a bounded queue while
+sess.run executes the current step (TF releases the GIL while it runs). The thread makes exactly the
+batches of one epoch in order, so the dataset state and its random draws are the same as when the batches
+are made in the training loop.
+"""
+
+
+class Prefetcher():
+    def __init__(self, next_batch, num_batches, depth):
+        '''
+        next_batch: function returning the next batch, called num_batches times from the thread.
+        depth: number of batches prepared ahead, 0 makes them in the caller's thread.
+        '''
+        self.next_batch = next_batch
+        self.num_batches = num_batches
+        self.depth = depth
+        self.queue = queue.Queue(maxsize=max(depth, 1))
+        self.stop = threading.Event()
+        self.thread = None
+        if depth > 0:
+            self.thread = threading.Thread(target=self.produce, daemon=True)
+            self.thread.start()
+
+    def produce(self):
+        try:
+            for _ in range(self.num_batches):
+                if not self.put((True, self.next_batch())): return
+        except Exception as e:
+            self.put((False, e))
+
+    def put(self, item):
+        # Wakes up regularly so that close() never waits on a full queue
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __iter__(self):
+        for _ in range(self.num_batches):
+            if self.thread is None:
+                yield self.next_batch()
+                continue
+            ok, batch = self.queue.get()
+            if not ok: raise batch
+            yield batch
+
+    def close(self):
+        if self.thread is None: return
+        self.stop.set()
+        # Drop what is left so a producer blocked on put() can exit
+        while self.thread.is_alive():
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                self.thread.join(0.1)
+        self.thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == '__main__':
+    # A slow batch source against a slow step: prefetching overlaps them
+    def slow_batch():
+        time.sleep(0.01)
+        return 0
+
+    for depth in [0, 4]:
+        start = time.time()
+        with Prefetcher(slow_batch, 100, depth) as batches:
+            for batch in batches:
+                time.sleep(0.01)
+        print('depth {}: {:.2f}s'.format(depth, time.time() - start))
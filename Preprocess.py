@@ -1,14 +1,21 @@
 from string import ascii_letters, digits
 import os
+import bisect
+import hashlib
+import multiprocessing
 import xml.etree.ElementTree as ET
 import pickle
 from Config import MyConfig, HyperParams_Tri_classification as hp_f
 import pprint
-from bs4 import BeautifulSoup
+from SgmReader import read_sgm
 import json
 
 pp = pprint.PrettyPrinter(indent=4)
 
+# Any change of the preprocessing code invalidates the per-document cache.
+with open(__file__, 'rb') as _f:
+    PREPROCESS_CODE_VERSION = hashlib.sha1(_f.read()).hexdigest()
+
 
 class PreprocessManager():
     def __init__(self):
@@ -17,20 +24,18 @@ class PreprocessManager():
         self.dataset = []
         self.tri_task_format_data = []
         self.arg_task_format_data = []
+        self.cache_path = MyConfig.preprocess_cache_path
+        self.corpus_digest = None
 
-    def preprocess(self, tasktype, subtasktype):
+    def preprocess(self, tasktype, subtasktype, num_workers=None):
         '''
         Overall Iterator for whole dataset
         '''
-        fnames = self.fname_search()
-        print('Total XML file: {}'.format(len(fnames)))
-        total_res = []
-        for fname in fnames:
-            total_res.append(self.process_one_file(fname))
+        total_res = list(self.iter_documents(num_workers))
         print('total_event: {}개'.format(len(total_res)))
 
-        for doc in total_res:
-            self.dataset += self.process_sentencewise(doc)
+        for sentences in total_res:
+            self.dataset += sentences
         print("END PREPROCESSING")
         print('TOTAL DATA :  {}'.format(len(self.dataset)))
         if tasktype=='TRIGGER':
@@ -43,45 +48,123 @@ class PreprocessManager():
         print('TRIGGER DATASET: {}\nARGUMENT DATASET: {}\n'.format(len(self.tri_task_format_data),
                                                                    len(self.arg_task_format_data)))
 
+    def iter_documents(self, num_workers=None):
+        '''
+        Return a generator of the sentence-wise data of every (sgm, apf.xml) pair, one list per document.
+        Only the cache keys are computed here (so corpus_digest is known right away), documents are
+        read from the cache or parsed while the generator is consumed.
+        '''
+        fnames = self.fname_search()
+        print('Total XML file: {}'.format(len(fnames)))
+        keys = [self.document_cache_key(fname) for fname in fnames]
+        self.corpus_digest = hashlib.sha1(''.join(keys).encode()).hexdigest()
+        return self.generate_documents(fnames, keys, num_workers)
+
+    def generate_documents(self, fnames, keys, num_workers=None):
+        '''
+        Documents whose contents are unchanged since the last run are read from the cache,
+        only the added or changed ones are parsed again.
+        '''
+        missing = [idx for idx, key in enumerate(keys) if not self.has_document_cache(key)]
+        print('Cached XML file: {}, To parse: {}'.format(len(fnames) - len(missing), len(missing)))
+
+        parsed = self.parse_documents([fnames[idx] for idx in missing], num_workers)
+        missing = set(missing)
+        for idx, key in enumerate(keys):
+            if idx in missing:
+                res = next(parsed)
+                self.dump_document_cache(key, res)
+            else:
+                res = self.load_document_cache(key)
+            yield res
+
+    def parse_documents(self, fnames, num_workers=None):
+        '''
+        Parse the documents lazily, with num_workers > 1 they are spread over a process pool.
+        '''
+        if num_workers is None: num_workers = MyConfig.preprocess_workers
+        if num_workers <= 1 or len(fnames) <= 1:
+            for fname in fnames:
+                yield self.process_sentencewise(self.process_one_file(fname))
+            return
+        with multiprocessing.Pool(num_workers) as pool:
+            # Pool.imap keeps the order of fnames, so the result is identical to the serial path.
+            yield from pool.imap(process_one_document, fnames)
+
+    @staticmethod
+    def iter_sentences(documents):
+        for sentences in documents:
+            yield from sentences
+
+    @staticmethod
+    def document_cache_key(fname):
+        # fname = (sgm fname, apf.xml fname). The path is part of the key because it is stored in the data.
+        key = hashlib.sha1(PREPROCESS_CODE_VERSION.encode())
+        for path in fname:
+            key.update(path.encode())
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    key.update(f.read())
+        return key.hexdigest()
+
+    def has_document_cache(self, key):
+        return self.cache_path is not None and os.path.exists(os.path.join(self.cache_path, key + '.bin'))
+
+    def load_document_cache(self, key):
+        cache_fname = os.path.join(self.cache_path, key + '.bin')
+        with open(cache_fname, 'rb') as f:
+            return pickle.load(f)
+
+    def dump_document_cache(self, key, res):
+        if self.cache_path is None: return
+        os.makedirs(self.cache_path, exist_ok=True)
+        cache_fname = os.path.join(self.cache_path, key + '.bin')
+        # Write to a temporary file first, an interrupted run must not leave a broken entry behind.
+        with open(cache_fname + '.tmp', 'wb') as f:
+            pickle.dump(res, f)
+        os.replace(cache_fname + '.tmp', cache_fname)
+
     def format_to_trigger(self, subtasktype):
-        for item in self.dataset:
+        self.tri_task_format_data += self.iter_trigger_candidates(self.dataset, subtasktype)
+
+    def iter_trigger_candidates(self, sentences, subtasktype):
+        '''
+        Yield [sentence, entity_position, fname, [[candidate index, label], ...]] per sentence.
+        '''
+        for item in sentences:
             d = item[0]
             fname = item[1]
-            generated_candi = self.generate_trigger_candidate_pos_list(d['trigger_position'], d['entity_position'], subtasktype)
             if len(d['sentence'])>hp_f.max_sequence_length:continue
-            for candi in generated_candi:
-                # Whether except the 'None' label at classification
-                if subtasktype == 'CLASSIFICATION' and candi[1] == 'None': continue
-                self.tri_task_format_data.append([d['sentence']]+candi+[fname]+[d['entity_position']])
+            generated_candi = self.generate_trigger_candidate_pos_list(d['trigger_position'], d['entity_position'], subtasktype)
+            # Whether except the 'None' label at classification
+            if subtasktype == 'CLASSIFICATION':
+                generated_candi = [candi for candi in generated_candi if candi[1] != 'None']
+            if generated_candi:
+                yield [d['sentence'], d['entity_position'], fname, generated_candi]
 
     def generate_trigger_candidate_pos_list(self, trigger_pos, entity_pos, subtasktype):
         cand_list = []
-        idx_list = []
-        for idx,el in enumerate(trigger_pos):
-            if el!='*': idx_list.append((idx,el))
-
         assert len(entity_pos)==len(trigger_pos)
 
-        for idx in range(len(trigger_pos)):
-            marks = ['A' for i in range(len(trigger_pos))]
-            marks[idx]='B'
+        for idx,el in enumerate(trigger_pos):
             label = 'None'
-            for i in idx_list:
-                if idx == i[0]:
-                    label = i[1] if subtasktype=='CLASSIFICATION' else 'TRIGGER'  # else: Identification case
-            cand_list.append([marks,label])
+            if el!='*':
+                label = el if subtasktype=='CLASSIFICATION' else 'TRIGGER'  # else: Identification case
+            cand_list.append([idx,label])
         return cand_list
 
     def process_sentencewise(self, doc):
         entities, val_timexs, events, xml_fname = doc
+        entity_index = self.build_entity_index(entities)
+        val_timex_index = self.build_valtimex_index(val_timexs)
         datas = []
         for event in events:
             for e_mention in event['event_mention']:
                 tmp = {'TYPE': event['TYPE'], 'SUBTYPE': event['SUBTYPE']}
                 tmp['raw_sent'] = e_mention['ldc_scope']['text']
                 sent_pos = [int(i) for i in e_mention['ldc_scope']['position']]
-                entities_in_sent = self.search_entity_in_sentence(entities, sent_pos)
-                val_timexs_in_sent = self.search_valtimex_in_sentence(val_timexs, sent_pos)
+                entities_in_sent = self.search_entity_in_sentence(entity_index, sent_pos)
+                val_timexs_in_sent = self.search_valtimex_in_sentence(val_timex_index, sent_pos)
                 e_mention = self.get_argument_head(entities_in_sent, e_mention)
                 res = self.packing_sentence(e_mention, tmp, sent_pos, entities_in_sent, val_timexs_in_sent)
                 if res!=1: datas.append([res,xml_fname])
@@ -99,57 +182,51 @@ class PreprocessManager():
         assert self.check_entity_overlap(entities, valtimexes)
         raw_sent = e_mention['ldc_scope']['text']
 
-        idx_list = [0 for i in range(len(raw_sent))]
-        if not (len(idx_list) == (int(e_mention['ldc_scope']['position'][1])-int(e_mention['ldc_scope']['position'][0])+1)):
-            return 1
         sent_start_idx = int(e_mention['ldc_scope']['position'][0])
+        if not (len(raw_sent) == (int(e_mention['ldc_scope']['position'][1])-sent_start_idx+1)):
+            return 1
 
-        trigger_idx_list = [0 for i in range(len(raw_sent))]
-        # pp.pprint(e_mention['anchor'])
-        # input()
-        #
-        # for tri in e_mention['anchor']:
-        #
+        # Entity and Value&Timex2 spans relative to the sentence, [start, end] both inclusive
+        entity_spans = self.relative_spans([ent['head']['position'] for ent in entities], sent_start_idx)
+        valtimex_spans = self.relative_spans([val['position'] for val in valtimexes], sent_start_idx)
 
-        # Mark Entity position
-        for ent in entities:
-            ent_start_idx = int(ent['head']['position'][0])
-            for i in range(int(ent['head']['position'][1]) - int(ent['head']['position'][0]) + 1):
-                if idx_list[ent_start_idx + i - sent_start_idx]==1: raise ValueError('까율~~~~~~~~~~~~~~~~~~')
-                idx_list[ent_start_idx + i - sent_start_idx] = 1  # entity mark
+        # Entity heads must not overlap each other
+        max_end = -1
+        for start, end in entity_spans:
+            if start <= max_end: raise ValueError('까율~~~~~~~~~~~~~~~~~~')
+            max_end = end
 
+        # Mark Value&Timex2 position, only when none of them overlaps an entity
+        entity_starts = [start for start, _ in entity_spans]
         dupl_exist = False
-        # Mark Value&Timex2 position
-        for val in valtimexes:
-            ent_start_idx = int(val['position'][0])
-            for i in range(int(val['position'][1]) - int(val['position'][0]) + 1):
-                if idx_list[ent_start_idx + i - sent_start_idx] == 1:  # entity mark
-                    dupl_exist = True
-        if not dupl_exist:
-            for val in valtimexes:
-                ent_start_idx = int(val['position'][0])
-                for i in range(int(val['position'][1]) - int(val['position'][0]) + 1):
-                    idx_list[ent_start_idx + i - sent_start_idx] = 1  # entity mark
-
-        token_list = []
-        entity_mark_list = []
-        curr_token = ''
-        # TODO: save each mark as variable, not to type 'N' or 'E' each time.
-        for idx, el in enumerate(raw_sent):
-            if idx==0:
-                curr_token += el
-                continue
-            if idx_list[idx]!=idx_list[idx-1]:
-                if idx_list[idx-1]==1: entity_mark_list.append('E')
-                else: entity_mark_list.append('*')
-                token_list.append(curr_token)
-                curr_token = el
-                continue
-            curr_token += el
-            if idx == len(e_mention['ldc_scope']['text'])-1:
-                if idx_list[idx]==1: entity_mark_list.append('E')
-                else: entity_mark_list.append('*')
-                token_list.append(curr_token)
+        for start, end in valtimex_spans:
+            # Entity spans are disjoint and sorted, the last one starting up to `end` is the only candidate.
+            k = bisect.bisect_right(entity_starts, end) - 1
+            if k >= 0 and entity_spans[k][1] >= start:
+                dupl_exist = True
+        marked_spans = entity_spans if dupl_exist else sorted(entity_spans + valtimex_spans)
+
+        # Merge overlapping and adjacent marked spans into runs of entity characters
+        merged = []
+        for start, end in marked_spans:
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+
+        # Cut the sentence into alternating plain ('*') and entity ('E') runs
+        runs = []
+        prev_end = 0
+        for start, end in merged:
+            if start > prev_end: runs.append((prev_end, start, '*'))
+            runs.append((start, end + 1, 'E'))
+            prev_end = end + 1
+        if prev_end < len(raw_sent): runs.append((prev_end, len(raw_sent), '*'))
+        # A single character run at the end of the sentence is not a token (kept from the char-by-char tokenizer).
+        if runs and runs[-1][1] - runs[-1][0] < 2: runs.pop()
+
+        token_list = [raw_sent[start:end] for start, end, _ in runs]
+        entity_mark_list = [mark for _, _, mark in runs]
 
         assert len(token_list)==len(entity_mark_list)
         splitted_token_list = []  # TODO: The better name....
@@ -262,6 +339,11 @@ class PreprocessManager():
 
         return packed_data
 
+    @staticmethod
+    def relative_spans(positions, sent_start_idx):
+        spans = [(int(pos[0]) - sent_start_idx, int(pos[1]) - sent_start_idx) for pos in positions]
+        return sorted((start, end) for start, end in spans if start <= end)
+
     @staticmethod
     def is_tail_symbol_only_check(str):
         if str[-1] in ascii_letters+digits: return False
@@ -278,37 +360,49 @@ class PreprocessManager():
         return True
 
     @staticmethod
-    def search_entity_in_sentence(entities, sent_pos):
+    def build_entity_index(entities):
         headVSextent = 'head'
-        entities_in_sent = list()
-        check = dict()
+        spans = []
         for entity in entities:
             for mention in entity['mention']:
-                if sent_pos[0] <= int(mention[headVSextent]['position'][0]) and int(mention[headVSextent]['position'][1]) <= sent_pos[1]:
-                    if mention[headVSextent]['position'][0] in check:  # duplicate entity in one word.
-                        #print('으악!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!')
-                        #raise ValueError
-                        continue
-                    check[mention[headVSextent]['position'][0]] = 1
-                    entities_in_sent.append(mention)
-        return entities_in_sent
+                spans.append((int(mention[headVSextent]['position'][0]), int(mention[headVSextent]['position'][1]), mention))
+        return SpanIndex(spans)
 
     @staticmethod
-    def search_valtimex_in_sentence(valtimex, sent_pos):
-        valtimex_in_sent = list()
+    def build_valtimex_index(valtimex):
+        spans = []
         for item in valtimex:
             for mention in item['mention']:
-                if sent_pos[0] <= int(mention['position'][0]) and sent_pos[1] >= int(mention['position'][1]):
-                    valtimex_in_sent.append(mention)
-        return valtimex_in_sent
+                spans.append((int(mention['position'][0]), int(mention['position'][1]), mention))
+        return SpanIndex(spans)
+
+    @staticmethod
+    def search_entity_in_sentence(entity_index, sent_pos):
+        entities_in_sent = list()
+        prev_start = None
+        # Matches come sorted by (start, document order), so the first one of each start is kept.
+        for k in entity_index.query(sent_pos[0], sent_pos[1]):
+            if entity_index.starts[k] == prev_start:  # duplicate entity in one word.
+                continue
+            prev_start = entity_index.starts[k]
+            entities_in_sent.append(k)
+        return [entity_index.items[k] for k in sorted(entities_in_sent, key=lambda k: entity_index.order[k])]
+
+    @staticmethod
+    def search_valtimex_in_sentence(valtimex_index, sent_pos):
+        valtimex_in_sent = valtimex_index.query(sent_pos[0], sent_pos[1])
+        return [valtimex_index.items[k] for k in sorted(valtimex_in_sent, key=lambda k: valtimex_index.order[k])]
 
     def format_to_argument(self, subtasktype):
-        for item in self.dataset:
+        self.arg_task_format_data += self.iter_argument_candidates(self.dataset, subtasktype)
+
+    def iter_argument_candidates(self, sentences, subtasktype):
+        '''
+        Yield [sentence, entity_position, fname, trigger index, [[candidate index, label], ...]] per sentence.
+        '''
+        for item in sentences:
             d = item[0]
             fname = item[1]
-            generated_candi = self.generate_argument_candidate_pos_list(d['argument_position'], d['entity_position'],
-                                                                        d['trigger_position'], subtasktype)
-
             if len(d['sentence'])>80:continue
 
             trigger_cnt = 0
@@ -316,8 +410,11 @@ class PreprocessManager():
                 if m=='T':trigger_cnt+=1
             if trigger_cnt>1:continue
 
-            for candi in generated_candi:
-                self.arg_task_format_data.append([d['sentence']]+candi+[fname])
+            generated_candi = self.generate_argument_candidate_pos_list(d['argument_position'], d['entity_position'],
+                                                                        d['trigger_position'], subtasktype)
+            tri_idx_list = [j for j, a in enumerate(d['trigger_position']) if a != '*']
+            if generated_candi:
+                yield [d['sentence'], d['entity_position'], fname, tri_idx_list[0] if tri_idx_list else -1, generated_candi]
 
     def generate_argument_candidate_pos_list(self, arg_pos, enti_pos, trigger_pos, subtasktype):
         cand_list = []
@@ -329,14 +426,6 @@ class PreprocessManager():
                 if enti_pos[idx]!='E': continue
             if trigger_pos[idx]!='*': continue
 
-            tri_idx_list = []
-            for j,a in enumerate(trigger_pos):
-                if a != '*': tri_idx_list.append(j)
-
-            marks = ['A' for i in range(len(arg_pos))]
-            marks[idx]='B'
-            for i in tri_idx_list:
-                marks[i]='T'
             label = 'None' if arg_pos[idx]=='*' else arg_pos[idx]
 
             '''
@@ -344,7 +433,7 @@ class PreprocessManager():
             '''
             if 'Time-' in label: label = 'Time'
             if subtasktype=='IDENTIFICATION' and label!='None':label = 'ARGUMENT'
-            cand_list.append([marks,label])
+            cand_list.append([idx,label])
         return cand_list
 
     @staticmethod
@@ -382,123 +471,127 @@ class PreprocessManager():
         return xml_ent_res, xml_valtimex_res, xml_event_res, fname[1]
 
     def parse_one_xml(self, fname):
-        tree = ET.parse(fname)
-        root = tree.getroot()
+        '''
+        Stream the APF file and parse each entity, value/timex2 and event as soon as its element is closed.
+        Processed elements are dropped from the tree, so memory does not grow with the file size.
+        '''
         entities, val_timex, events = [], [], []
-
-        for child in root[0]:
-            if child.tag == 'entity':
-                entities.append(self.xml_entity_parse(child, fname))
-            if child.tag in ['value', 'timex2']:
-                val_timex.append(self.xml_value_timex_parse(child, fname))
-            if child.tag == 'event':
-                events.append(self.xml_event_parse(child, fname))
+        depth = 0
+        document = None
+        for action, elem in ET.iterparse(fname, events=('start', 'end')):
+            if action == 'start':
+                depth += 1
+                if depth == 2: document = elem  # root[0]
+                continue
+            depth -= 1
+            if depth != 2: continue  # only the children of root[0] are records
+            if elem.tag == 'entity':
+                entities.append(self.xml_entity_parse(elem, fname))
+            if elem.tag in ['value', 'timex2']:
+                val_timex.append(self.xml_value_timex_parse(elem, fname))
+            if elem.tag == 'event':
+                events.append(self.xml_event_parse(elem, fname))
+            elem.clear()
+            document.remove(elem)
         return entities, val_timex, events
 
+    @staticmethod
+    def xml_charseq_parse(charseq):
+        return {'position': [int(charseq.attrib['START']), int(charseq.attrib['END'])], 'text': charseq.text}
+
     def xml_value_timex_parse(self, item, fname):
-        child = item.attrib
+        child = dict(item.attrib)
         child['fname'] = fname
         child['mention'] = []
         for sub in item:
-            mention = sub.attrib
-            mention['position'] = [sub[0][0].attrib['START'], sub[0][0].attrib['END']]
-            mention['text'] = sub[0][0].text
+            mention = dict(sub.attrib)
+            charseq = self.xml_charseq_parse(sub[0][0])
+            mention['position'] = charseq['position']
+            mention['text'] = charseq['text']
             child['mention'].append(mention)
         return child
 
     def xml_entity_parse(self, item, fname):
-        entity = item.attrib
+        entity = dict(item.attrib)
         entity['fname'] = fname
         entity['mention'] = []
         entity['attribute'] = []  # What is this exactly?
         for sub in item:
             if sub.tag != 'entity_mention': continue
-            mention = sub.attrib
+            mention = dict(sub.attrib)
             for el in sub:  # charseq and head
-                mention[el.tag] = dict()
-                mention[el.tag]['position'] = [el[0].attrib['START'], el[0].attrib['END']]
-                mention[el.tag]['text'] = el[0].text
+                mention[el.tag] = self.xml_charseq_parse(el[0])
             entity['mention'].append(mention)
         return entity
 
     def xml_event_parse(self, item, fname):
         #  event: one event item
-        event = item.attrib
+        event = dict(item.attrib)
         event['fname'] = fname
         event['argument'] = []
         event['event_mention'] = []
         for sub in item:
             if sub.tag == 'event_argument':
-                tmp = sub.attrib
-                event['argument'].append(tmp)
+                event['argument'].append(dict(sub.attrib))
                 continue
             if sub.tag == 'event_mention':
-                mention = sub.attrib  # init dict with mention ID
+                mention = dict(sub.attrib)  # init dict with mention ID
                 mention['argument'] = []
                 for el in sub:
                     if el.tag == 'event_mention_argument':
-                        one_arg = el.attrib
-                        one_arg['position'] = [el[0][0].attrib['START'], el[0][0].attrib['END']]
-                        one_arg['text'] = el[0][0].text
+                        one_arg = dict(el.attrib)
+                        charseq = self.xml_charseq_parse(el[0][0])
+                        one_arg['position'] = charseq['position']
+                        one_arg['text'] = charseq['text']
                         mention['argument'].append(one_arg)
                     else:  # [extent, ldc_scope, anchor] case
                         for seq in el:
-                            mention[el.tag] = dict()
-                            mention[el.tag]['position'] = [seq.attrib['START'], seq.attrib['END']]
-                            mention[el.tag]['text'] = seq.text
+                            mention[el.tag] = self.xml_charseq_parse(seq)
                 event['event_mention'].append(mention)
         return event
 
     def parse_one_sgm(self, fname):
         print('fname :', fname)
-        with open(fname, 'r') as f:
-            data = f.read()
-            soup = BeautifulSoup(data, features='html.parser')
-
-            doc = soup.find('doc')
-            doc_id = doc.docid.text
-            doc_type = doc.doctype.text.strip()
-            date_time = doc.datetime.text
-            headline = doc.headline.text if doc.headline else ''
-
-            body = []
-
-            if doc_type == 'WEB TEXT':
-                posts = soup.findAll('post')
-                for post in posts:
-                    poster = post.poster.text
-                    post.poster.extract()
-                    post_date = post.postdate.text
-                    post.postdate.extract()
-                    subject = post.subject.text if post.subject else ''
-                    if post.subject: post.subject.extract()
-                    text = post.text
-                    body.append({
-                        'poster': poster,
-                        'post_date': post_date,
-                        'subject': subject,
-                        'text': text,
-                    })
-            elif doc_type in ['STORY', 'CONVERSATION', 'NEWS STORY']:
-                turns = soup.findAll('turn')
-                for turn in turns:
-                    speaker = turn.speaker.text if turn.speaker else ''
-                    if turn.speaker: turn.speaker.extract()
-                    text = turn.text
-                    body.append({
-                        'speaker': speaker,
-                        'text': text,
-                    })
-
-            result = {
-                'doc_id': doc_id,
-                'doc_type': doc_type,
-                'date_time': date_time,
-                'headline': headline,
-                'body': body,
-            }
-
-            return result
+        sgm = read_sgm(fname)
+
+        doc = sgm.find('doc')
+        doc_id = sgm.element_text(sgm.find('docid', doc))
+        doc_type = sgm.element_text(sgm.find('doctype', doc)).strip()
+        date_time = sgm.element_text(sgm.find('datetime', doc))
+        headline = sgm.element_text(sgm.find('headline', doc))
+
+        body = []
+
+        if doc_type == 'WEB TEXT':
+            posts = sgm.find_all('post')
+            for post in posts:
+                poster = sgm.find('poster', post)
+                post_date = sgm.find('postdate', post)
+                subject = sgm.find('subject', post)
+                body.append({
+                    'poster': sgm.element_text(poster),
+                    'post_date': sgm.element_text(post_date),
+                    'subject': sgm.element_text(subject),
+                    'text': sgm.element_text(post, exclude=[poster, post_date, subject]),
+                })
+        elif doc_type in ['STORY', 'CONVERSATION', 'NEWS STORY']:
+            turns = sgm.find_all('turn')
+            for turn in turns:
+                speaker = sgm.find('speaker', turn)
+                body.append({
+                    'speaker': sgm.element_text(speaker),
+                    'text': sgm.element_text(turn, exclude=[speaker]),
+                })
+
+        result = {
+            'doc_id': doc_id,
+            'doc_type': doc_type,
+            'date_time': date_time,
+            'headline': headline,
+            'body': body,
+        }
+
+        return result
 
     def Data2Json(self, data):
         pass
@@ -510,9 +603,34 @@ class PreprocessManager():
         pass
 
 
+class SpanIndex():
+    '''
+    Interval index over the (start, end, item) spans of one document, sorted by start offset.
+    query() returns the positions of the spans lying inside [start, end].
+    '''
+    def __init__(self, spans):
+        # Python's sort is stable, so spans with the same start keep their document order.
+        order = sorted(range(len(spans)), key=lambda k: spans[k][0])
+        self.starts = [spans[k][0] for k in order]
+        self.ends = [spans[k][1] for k in order]
+        self.items = [spans[k][2] for k in order]
+        self.order = order
+
+    def query(self, start, end):
+        lo = bisect.bisect_left(self.starts, start)
+        hi = bisect.bisect_right(self.starts, end)
+        return [k for k in range(lo, hi) if self.ends[k] <= end]
+
+
+def process_one_document(fname):
+    # Module level function, so that multiprocessing.Pool can send it to the worker processes.
+    man = PreprocessManager()
+    return man.process_sentencewise(man.process_one_file(fname))
+
+
 if __name__ == '__main__':
     man = PreprocessManager()
-    man.preprocess()
+    man.preprocess(tasktype='ARGUMENT', subtasktype='CLASSIFICATION')
 
     # Example
     trigger_classification_data = man.tri_task_format_data
@@ -523,8 +641,9 @@ if __name__ == '__main__':
     all_labels = set()
     total = 0
     for data in argument_classification_data:
-        total += 1
-        all_labels.add(data[2])
+        for _, label in data[4]:
+            total += 1
+            all_labels.add(label)
 
     print('total :', total)
     print('label len:', len(all_labels))
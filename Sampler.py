@@ -0,0 +1,129 @@
+import numpy as np
+
+"""
+Samplers of the training candidates, both return positions in the train set and copy no instance.
+WeightedSampler rebalances the labels: the positions are grouped by label in one array, a sample draws labels
+with the class weights and then a position inside each drawn label. NegativeSubsampler keeps a new random
+subset of the None candidates every epoch. TrainIndex gives the datasets the shuffled positions of each epoch.
+"""
+
+CLASS_WEIGHTS = ['uniform', 'inverse', 'capped']
+
+
+class WeightedSampler():
+    def __init__(self, labels, num_labels, class_weights='inverse', cap=5.0):
+        '''
+        labels: label id of every training candidate, samples are positions in this array.
+        class_weights: 'uniform' keeps the label frequencies, 'inverse' weights each candidate by the inverse
+        frequency of its label (every label as likely), 'capped' is 'inverse' with the up-weighting of a
+        label limited to cap.
+        '''
+        labels = np.asarray(labels, dtype=np.int64)
+        self.counts = np.bincount(labels, minlength=num_labels)
+        # Positions grouped by label, label l at [starts[l], starts[l] + counts[l])
+        self.order = np.argsort(labels, kind='stable')
+        self.starts = np.concatenate([[0], np.cumsum(self.counts)[:-1]])
+        weights = self.label_weights(self.counts, class_weights, cap)
+        self.label_p = self.counts * weights / (self.counts * weights).sum()
+
+    @staticmethod
+    def label_weights(counts, class_weights, cap):
+        if class_weights not in CLASS_WEIGHTS:
+            raise ValueError('unknown class_weights: {}'.format(class_weights))
+        if class_weights == 'uniform': return np.ones(len(counts))
+        weights = np.divide(counts.max(), counts, out=np.zeros(len(counts)), where=counts > 0)
+        if class_weights == 'capped': weights = np.minimum(weights, cap)
+        return weights
+
+    def sample(self, size):
+        labels = np.random.choice(len(self.counts), size, p=self.label_p)
+        offsets = (np.random.random_sample(size) * self.counts[labels]).astype(np.int64)
+        return self.order[self.starts[labels] + offsets]
+
+
+class NegativeSubsampler():
+    def __init__(self, labels, sentences, none_label, ratio=None, per_sentence=None, seed=0):
+        '''
+        Keeps every candidate that is not none_label and, each epoch, a fresh subset of the None candidates:
+        at most per_sentence of them in each sentence, then the given ratio of those. The subset of epoch e is
+        drawn with seed + e, so it does not depend on the rest of the training and the epoch size is fixed.
+        '''
+        labels = np.asarray(labels, dtype=np.int64)
+        self.positives = np.flatnonzero(labels != none_label)
+        self.negatives = np.flatnonzero(labels == none_label)
+        self.negative_sentences = np.asarray(sentences, dtype=np.int64)[self.negatives]
+        self.ratio = ratio
+        self.per_sentence = per_sentence
+        self.seed = seed
+
+        num_negatives = len(self.negatives)
+        if per_sentence is not None:
+            per_sent_counts = np.bincount(self.negative_sentences)
+            num_negatives = int(np.minimum(per_sent_counts, per_sentence).sum())
+        if ratio is not None: num_negatives = int(round(num_negatives * ratio))
+        self.num_negatives = num_negatives
+        self.size = len(self.positives) + num_negatives
+
+    def sample(self, epoch):
+        '''
+        Positions kept in the given epoch, positives first and not shuffled, see TrainIndex.
+        '''
+        rng = np.random.RandomState(self.seed + epoch)
+        negatives = self.negatives
+        if self.per_sentence is not None:
+            # Random rank of each None candidate inside its sentence
+            order = np.lexsort([rng.random_sample(len(negatives)), self.negative_sentences])
+            sents = self.negative_sentences[order]
+            first = np.searchsorted(sents, sents)
+            negatives = negatives[order][np.arange(len(sents)) - first < self.per_sentence]
+        if self.ratio is not None:
+            negatives = rng.choice(negatives, self.num_negatives, replace=False)
+        return np.concatenate([self.positives, np.sort(negatives)])
+
+
+class TrainIndex():
+    def __init__(self, labels, sentences, num_labels, none_label=None, class_weights=None, class_weight_cap=5.0,
+                 none_ratio=None, none_per_sentence=None, none_seed=0):
+        '''
+        Positions in the train set to train on each epoch, shared by both datasets.
+        class_weights: None trains on every candidate once per epoch, otherwise WeightedSampler draws them.
+        none_ratio / none_per_sentence: NegativeSubsampler of the none_label candidates, not with class_weights.
+        '''
+        subsampling = none_ratio is not None or none_per_sentence is not None
+        if class_weights is not None and subsampling:
+            raise ValueError('class_weights and the None subsampling (none_ratio, none_per_sentence) do not combine')
+        self.num_candidates = len(labels)
+        self.sampler = None
+        if class_weights is not None:
+            self.sampler = WeightedSampler(labels, num_labels, class_weights, class_weight_cap)
+        # The eval splits keep all of their None candidates
+        self.subsampler = None
+        if subsampling and none_label is not None:
+            self.subsampler = NegativeSubsampler(labels, sentences, none_label, none_ratio, none_per_sentence, none_seed)
+            print('None subsampling: {} of {} train candidates per epoch'.format(self.subsampler.size, len(labels)))
+        self.size = len(labels) if self.subsampler is None else self.subsampler.size
+        self.index = None
+
+    def epoch_index(self, epoch):
+        '''
+        Shuffled positions of the given epoch.
+        '''
+        if self.sampler is not None:
+            return self.sampler.sample(self.size)
+        if self.subsampler is not None:
+            self.index = self.subsampler.sample(epoch)
+            np.random.shuffle(self.index)
+        else:
+            if self.index is None: self.index = np.arange(self.num_candidates)
+            np.random.shuffle(self.index)
+        return self.index
+
+
+if __name__ == '__main__':
+    # The 17:1 None:TRIGGER imbalance of trigger identification
+    labels = np.asarray([0] * 17000 + [1] * 1000)
+    for class_weights in CLASS_WEIGHTS:
+        sampler = WeightedSampler(labels, 2, class_weights)
+        print(class_weights, np.bincount(labels[sampler.sample(len(labels))], minlength=2))
+    train_index = TrainIndex(labels, np.arange(len(labels)) // 20, 2, 0, none_ratio=0.2, none_per_sentence=5)
+    print('first epoch labels:', labels[train_index.epoch_index(0)[:20]])
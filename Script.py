@@ -1,11 +1,12 @@
 import datetime, os, time
 import numpy as np
 import tensorflow as tf
-from sklearn.metrics import classification_report, precision_score, recall_score, f1_score, accuracy_score, precision_recall_fscore_support as prf_score
+from Metrics import ConfusionMatrix
+from Prefetcher import Prefetcher
 from Util import train_parser
 from Dataset import Dataset as ARGUMENT_DATASET
 from Dataset_Trigger import Dataset_Trigger as TRIGGER_DATASET
-from Config import HyperParams_Tri_classification as hp_trigger, HyperParams as hp_argument
+from Config import MyConfig, HyperParams_Tri_classification as hp_trigger, HyperParams as hp_argument
 import Visualize
 
 if __name__ == '__main__':
@@ -42,7 +43,13 @@ if __name__ == '__main__':
                           filter_sizes=hp.filter_sizes,
                           pos_tag_max_size=len(dataset.all_pos_taggings),
                           filter_num=hp.filter_num,
-                          embed_matrx=dataset.word_embed)
+                          embed_matrx=dataset.word_embed,
+                          sparse_labels=MyConfig.sparse_labels,
+                          pad_word_id=dataset.word_id['<eos>'],
+                          multi_pooling=MyConfig.dynamic_multi_pooling,
+                          conv_encoder=MyConfig.conv_encoder,
+                          windows=hp.windows,
+                          lexical_features=MyConfig.lexical_features)
 
             optimizer = tf.train.AdamOptimizer(hp.lr)
             grads_and_vars = optimizer.compute_gradients(model.loss)
@@ -56,12 +63,17 @@ if __name__ == '__main__':
             if not os.path.exists(checkpoint_dir):
                 os.makedirs(checkpoint_dir)
             saver = tf.train.Saver(tf.all_variables(), max_to_keep=20)
-            sess.run(tf.initialize_all_variables())
+            sess.run(tf.initialize_all_variables(), feed_dict=model.init_feed_dict)
+
+            def feed_labels(input_y):
+                # The datasets give label ids, one-hot them only for a model built with dense labels
+                if MyConfig.sparse_labels: return input_y
+                return np.eye(len(dataset.all_labels), dtype=np.float32)[input_y]
 
             def trigger_train_step(input_x, input_y, input_c, input_c_pos, input_pos_tag, dropout_keep_prob, log=False):
                 feed_dict = {
                     model.input_x: input_x,
-                    model.input_y: input_y,
+                    model.input_y: feed_labels(input_y),
                     model.input_c_pos: input_c_pos,
                     # model.input_pos_tag: input_pos_tag,
                     model.dropout_keep_prob: dropout_keep_prob,
@@ -72,52 +84,46 @@ if __name__ == '__main__':
                     print("{}: loss {:g}, acc {:g}".format(time_str, loss, accuracy))
 
 
-            def trigger_eval_step(input_x, input_y, input_c, input_c_pos, input_pos_tag, dropout_keep_prob, is_test=False):
+            def trigger_eval_step(input_x, input_y, input_c, input_c_pos, input_pos_tag, dropout_keep_prob):
                 feed_dict = {
                     model.input_x: input_x,
-                    model.input_y: input_y,
                     model.input_c_pos: input_c_pos,
                     # model.input_pos_tag: input_pos_tag,
                     model.dropout_keep_prob: dropout_keep_prob,
                 }
-                accuracy, predicts = sess.run([model.accuracy, model.predicts], feed_dict)
-                #print("eval accuracy:{}".format(accuracy))
+                return sess.run(model.predicts, feed_dict)
 
 
-                y_true = [np.argmax(item) for item in input_y]
-                y_pred = predicts
-                target_names = dataset.all_labels
+            def trigger_evaluate(batches, is_test=False):
+                # The split comes in chunks, only the confusion matrix is kept across them
+                confusion = ConfusionMatrix(len(dataset.all_labels))
+                html_file = Visualize.open_page(epoch)
+                for x, c, y, pos_c, pos_tag in batches:
+                    predicts = trigger_eval_step(input_x=x, input_y=y, input_c=c, input_c_pos=pos_c, input_pos_tag=pos_tag,
+                                                 dropout_keep_prob=1.0)
+                    confusion.update(y, predicts)
+                    Visualize.draw_batch(html_file, input_x=x, input_y=y, predicts=predicts, input_c_pos=pos_c,
+                                         id2label=dataset.id2label, id2word=dataset.id2word)
+                Visualize.close_page(html_file)
 
-                print(classification_report(y_true, y_pred,
-                                            target_names=dataset.all_labels))
+                print(confusion.report(target_names=dataset.all_labels))
 
                 metrics = ['macro','weighted','micro']
                 for metric in metrics:
                     print("\n##  {}  ##".format(metric))
-                    res = prf_score(y_true, y_pred,average=metric)
+                    res = confusion.prf(metric)
 
                     prf = [round(res[0]*100,2),round(res[1]*100,2),round(res[2]*100,2)]
                     print('Precision    Recall      F1')
                     print('{}      {}      {}'.format(prf[0], prf[1], prf[2]))
-                print('Accuracy: {}%'.format(round(100*accuracy,2)))
-
-                Visualize.draw(
-                    epoch=epoch,
-                    input_x=input_x,
-                    input_y=[np.argmax(item) for item in input_y],
-                    predicts=predicts,
-                    input_c_pos=input_c_pos,
-                    id2label = dataset.id2label,
-                    id2word=dataset.id2word,
-                )
-
-                return predicts
+                print('Accuracy: {}%'.format(round(100*confusion.accuracy(),2)))
+                return confusion
 
 
             def argument_train_step(input_x, input_y, input_t, input_c, input_t_pos, input_c_pos, dropout_keep_prob):
                 feed_dict = {
                     model.input_x: input_x,
-                    model.input_y: input_y,
+                    model.input_y: feed_labels(input_y),
                     # model.input_t:input_t,
                     # model.input_c:input_c,
                     model.input_t_pos: input_t_pos,
@@ -132,67 +138,63 @@ if __name__ == '__main__':
             def argument_eval_step(input_x, input_y, input_t, input_c, input_t_pos, input_c_pos, dropout_keep_prob):
                 feed_dict = {
                     model.input_x: input_x,
-                    model.input_y: input_y,
                     # model.input_t:input_t,
                     # model.input_c:input_c,
                     model.input_t_pos: input_t_pos,
                     model.input_c_pos: input_c_pos,
                     model.dropout_keep_prob: dropout_keep_prob,
                 }
-                accuracy, predicts = sess.run([model.accuracy, model.predicts], feed_dict)
-                from sklearn.metrics import classification_report
-                print("eval accuracy:{}".format(accuracy))
-                # print("input_y : ", [np.argmax(item) for item in input_y], ', predicts :', predicts)
-                print(classification_report([np.argmax(item) for item in input_y], predicts,
-                                            target_names=dataset.all_labels))
-                return predicts
+                return sess.run(model.predicts, feed_dict)
+
+
+            def argument_evaluate(batches):
+                confusion = ConfusionMatrix(len(dataset.all_labels))
+                for x, t, c, y, pos_c, pos_t, _ in batches:
+                    predicts = argument_eval_step(input_x=x, input_y=y, input_t=t, input_c=c, input_c_pos=pos_c,
+                                                  input_t_pos=pos_t,
+                                                  dropout_keep_prob=1.0)
+                    confusion.update(y, predicts)
+                print("eval accuracy:{}".format(confusion.accuracy()))
+                print(confusion.report(target_names=dataset.all_labels))
+                return confusion
 
 
             print("TRAIN START")
             for epoch in range(hp.num_epochs):
                 print('epoch: {}/{}'.format(epoch + 1, hp.num_epochs))
-                for j in range(len(dataset.train_instances) // hp.batch_size):
-                    if task == 1:
-                        x, c, y, pos_c, pos_tag = dataset.next_train_data()
-                        if j==0:
-                            trigger_train_step(input_x=x, input_y=y, input_c=c, input_c_pos=pos_c, input_pos_tag=pos_tag,
-                                               dropout_keep_prob=0.5, log=True)
-                        else:
-                            trigger_train_step(input_x=x, input_y=y, input_c=c, input_c_pos=pos_c,
-                                               input_pos_tag=pos_tag,
-                                               dropout_keep_prob=0.5)
-
-                    if task == 2:
-                        x, t, c, y, pos_c, pos_t, _ = dataset.next_train_data()
-                        argument_train_step(input_x=x, input_y=y, input_t=t, input_c=c, input_c_pos=pos_c,
-                                            input_t_pos=pos_t,
-                                            dropout_keep_prob=0.5)
+                # The next batches are made in the background while a step runs, the thread ends with the epoch
+                with Prefetcher(dataset.next_train_data, dataset.batch_nums, MyConfig.prefetch_batches) as batches:
+                    for j, batch in enumerate(batches):
+                        if task == 1:
+                            x, c, y, pos_c, pos_tag = batch
+                            if j==0:
+                                trigger_train_step(input_x=x, input_y=y, input_c=c, input_c_pos=pos_c, input_pos_tag=pos_tag,
+                                                   dropout_keep_prob=0.5, log=True)
+                            else:
+                                trigger_train_step(input_x=x, input_y=y, input_c=c, input_c_pos=pos_c,
+                                                   input_pos_tag=pos_tag,
+                                                   dropout_keep_prob=0.5)
+
+                        if task == 2:
+                            x, t, c, y, pos_c, pos_t, _ = batch
+                            argument_train_step(input_x=x, input_y=y, input_t=t, input_c=c, input_c_pos=pos_c,
+                                                input_t_pos=pos_t,
+                                                dropout_keep_prob=0.5)
 
                 if epoch % 5 == 0:
                     if task == 1:  # Trigger
-                        x, c, y, pos_c, pos_tag = dataset.next_valid_data()
-                        trigger_eval_step(input_x=x, input_y=y, input_c=c, input_c_pos=pos_c, input_pos_tag=pos_tag,
-                                           dropout_keep_prob=1.0)
+                        trigger_evaluate(dataset.valid_batches())
                         path = saver.save(sess, checkpoint_prefix + "-Trigger-Identification", epoch)
                         print("Saved model checkpoint to {}\n".format(path))
 
-                        x, c, y, pos_c, pos_tag = dataset.next_eval_data()
-                        trigger_eval_step(input_x=x, input_y=y, input_c=c, input_c_pos=pos_c, input_pos_tag=pos_tag,
-                                          dropout_keep_prob=1.0, is_test=True)
+                        trigger_evaluate(dataset.eval_batches(), is_test=True)
 
 
                     if task == 2:
-                        x, t, c, y, pos_c, pos_t, _ = dataset.eval_data()
-                        argument_eval_step(input_x=x, input_y=y, input_t=t, input_c=c, input_c_pos=pos_c,
-                                           input_t_pos=pos_t,
-                                           dropout_keep_prob=1.0)
+                        argument_evaluate(dataset.eval_batches())
 
             print("----test results---------------------------------------------------------------------")
             if task == 1:
-                x, c, y, pos_c, pos_tag = dataset.next_eval_data()
-                predicts = trigger_eval_step(input_x=x, input_y=y, input_c=c, input_c_pos=pos_c, input_pos_tag=pos_tag, dropout_keep_prob=1.0, is_test=True)
+                confusion = trigger_evaluate(dataset.eval_batches(), is_test=True)
             if task == 2:
-                x, t, c, y, pos_c, pos_t, _ = dataset.eval_data()
-                predicts = argument_eval_step(input_x=x, input_y=y, input_t=t, input_c=c, input_c_pos=pos_c,
-                                              input_t_pos=pos_t,
-                                              dropout_keep_prob=1.0)
+                confusion = argument_evaluate(dataset.eval_batches())
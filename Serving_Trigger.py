@@ -1,7 +1,10 @@
 import datetime, os, sys, json
+import numpy as np
 import tensorflow as tf
 from Dataset_Trigger import Dataset_Trigger as TRIGGER_DATASET
-from Config import HyperParams_Tri_classification as hp
+from Glove import GloveEmbedder
+from Model_Trigger import Model
+from Config import MyConfig, HyperParams_Tri_classification as hp
 import nltk
 
 from flask import Flask, session, g, request, render_template, redirect, Response, jsonify
@@ -36,8 +39,18 @@ def get_batch(sentence, word_id, max_sequence_length):
     return x_batch, x_pos_batch, tokens
 
 
+def get_word_vec_batch(tokens, embedder, max_sequence_length, num_copies=None):
+    # Word vectors of the sentence, where the words missing from word_id get their GloVe vector instead of <unk>
+    if num_copies is None: num_copies = max_sequence_length
+    words = tokens[:max_sequence_length] + ['<eos>'] * (max_sequence_length - len(tokens))
+    word_vec = embedder.embed_words(words)
+    return np.tile(word_vec[None], [num_copies, 1, 1])
+
+
 dataset = TRIGGER_DATASET(batch_size=hp.batch_size, max_sequence_length=hp.max_sequence_length,
                           windows=hp.windows, dtype='IDENTIFICATION')
+# The full GloVe matrix stays memory-mapped, only the vectors of the unseen words are read
+embedder = GloveEmbedder(dataset.word_embed, dataset.word_id) if MyConfig.serving_glove_oov else None
 
 checkpoint_dir = './runs/1543232582/checkpoints'
 checkpoint_file = tf.train.latest_checkpoint(checkpoint_dir)
@@ -46,11 +59,36 @@ graph = tf.Graph()
 with graph.as_default():
     sess = tf.Session()
     with sess.as_default():
-        # Load the saved meta graph and restore variables
-        saver = tf.train.import_meta_graph("{}.meta".format(checkpoint_file))
-        print('restore model from {}.meta'.format(checkpoint_file))
+        if MyConfig.serving_multi_candidate:
+            # Same variables as the trained graph, but the sentence is encoded once for all of its words
+            model = Model(sentence_length=hp.max_sequence_length,
+                          num_labels=len(dataset.all_labels),
+                          vocab_size=len(dataset.all_words),
+                          word_embedding_size=hp.word_embedding_size,
+                          pos_embedding_size=hp.pos_embedding_size,
+                          filter_sizes=hp.filter_sizes,
+                          filter_num=hp.filter_num,
+                          embed_matrx=dataset.word_embed,
+                          sparse_labels=MyConfig.sparse_labels,
+                          pad_word_id=dataset.word_id['<eos>'],
+                          multi_candidate=True,
+                          multi_pooling=MyConfig.dynamic_multi_pooling,
+                          conv_encoder=MyConfig.conv_encoder,
+                          windows=hp.windows,
+                          lexical_features=MyConfig.lexical_features)
+            saver = tf.train.Saver()
+            print('restore model variables from {}'.format(checkpoint_file))
+        else:
+            # Load the saved meta graph and restore variables
+            saver = tf.train.import_meta_graph("{}.meta".format(checkpoint_file))
+            print('restore model from {}.meta'.format(checkpoint_file))
         saver.restore(sess, checkpoint_file)
 
+        # Models saved before the word vectors were named can only take word ids
+        input_word_vec = None
+        if embedder is not None and "word_embedding_layer/input_word_vec" in [op.name for op in graph.get_operations()]:
+            input_word_vec = graph.get_tensor_by_name("word_embedding_layer/input_word_vec:0")
+
         @app.route('/api/event-extraction/trigger/identification', methods=['POST'])
         def serving():
             data = request.get_json()
@@ -63,17 +101,28 @@ with graph.as_default():
 
             # Get the placeholders from the graph by name
             input_x = graph.get_operation_by_name("input_x").outputs[0]
-            input_c_pos = graph.get_operation_by_name("input_c_pos").outputs[0]
             dropout_keep_prob = graph.get_operation_by_name("dropout_keep_prob").outputs[0]
 
             # Tensors we want to evaluate
             predictions = graph.get_operation_by_name("output/predicts").outputs[0]
 
-            feed_dict = {
-                input_x: x_batch,
-                input_c_pos: x_pos_batch,
-                dropout_keep_prob: 1.0,
-            }
+            if MyConfig.serving_multi_candidate:
+                # One sentence, every word of it a candidate
+                feed_dict = {
+                    input_x: x_batch[:1],
+                    graph.get_operation_by_name("input_c_sentence").outputs[0]: np.zeros(len(x_batch), dtype=np.int32),
+                    graph.get_operation_by_name("input_c_index").outputs[0]: np.arange(len(x_batch), dtype=np.int32),
+                    dropout_keep_prob: 1.0,
+                }
+            else:
+                feed_dict = {
+                    input_x: x_batch,
+                    graph.get_operation_by_name("input_c_pos").outputs[0]: x_pos_batch,
+                    dropout_keep_prob: 1.0,
+                }
+            if input_word_vec is not None:
+                num_copies = 1 if MyConfig.serving_multi_candidate else hp.max_sequence_length
+                feed_dict[input_word_vec] = get_word_vec_batch(tokens, embedder, hp.max_sequence_length, num_copies)
 
             preds = sess.run(predictions, feed_dict)
             print('id2label : ', dataset.id2label)
@@ -0,0 +1,144 @@
+import re
+import time
+from html.entities import html5
+
+"""
+Offset preserving reader for the ACE .sgm files, without building a BeautifulSoup tree.
+The document text is the file contents with the markup removed and character references decoded.
+By default it is exactly the text BeautifulSoup(html.parser) returns, which also collapses every
+whitespace-only string between two tags to one ' ' or '\n'; raw=True keeps those strings as they are.
+"""
+
+# Markup as html.parser sees it: tags (quoted attribute values may contain '>'), end tags, <!...> and <?...>
+MARKUP = re.compile(r'''<(?:(/?)([A-Za-z][^\s/>]*)(?:[^>"']|"[^"]*"|'[^']*')*>|/[^>]*>|[!?][^>]*>)''')
+CHARREF = re.compile(r'&(#[0-9]+;?|#[xX][0-9a-fA-F]+;?|[A-Za-z][-.A-Za-z0-9]*;?)')
+ASCII_SPACES = str.maketrans('', '', ' \n\t\x0c\r')
+PRESERVE_WHITESPACE_TAGS = {'pre', 'textarea'}
+
+
+def unescape_ref(match):
+    ref = match.group(1)
+    if ref[0] == '#':
+        hexadecimal = ref[1] in 'xX'
+        num = int(ref[2 if hexadecimal else 1:].rstrip(';'), 16 if hexadecimal else 10)
+        if 128 <= num < 160:  # like bs4, read as windows-1252
+            try:
+                return bytes([num]).decode('windows-1252')
+            except UnicodeDecodeError:
+                pass
+        return chr(num) if 0 < num <= 0x10FFFF else '\ufffd'
+    if ref in html5: return html5[ref]
+    name = ref.rstrip(';')
+    if name == ref and name in html5: return html5[name]
+    return '&' + name  # unknown reference, html.parser keeps it without the ';'
+
+
+class SgmDocument():
+    def __init__(self, text, elements):
+        self.text = text
+        # (tag, start, end, index, stop) for every element in document order: text[start:end] is its text,
+        # elements[index + 1:stop] are its descendants.
+        self.elements = elements
+
+    def find_all(self, tag, within=None):
+        lo, hi = (0, len(self.elements)) if within is None else (within[3] + 1, within[4])
+        return [el for el in self.elements[lo:hi] if el[0] == tag]
+
+    def find(self, tag, within=None):
+        found = self.find_all(tag, within)
+        return found[0] if found else None
+
+    def element_text(self, element, exclude=()):
+        '''
+        Text of element without the text of the excluded child elements (like bs4's extract()).
+        '''
+        if element is None: return ''
+        res, point = [], element[1]
+        for child in sorted((el for el in exclude if el is not None), key=lambda el: el[3]):
+            res.append(self.text[point:child[1]])
+            point = child[2]
+        res.append(self.text[point:element[2]])
+        return ''.join(res)
+
+
+def read_sgm(fname, raw=False):
+    with open(fname, 'r') as f:
+        data = f.read()
+
+    pieces, elements, stack = [], [], []
+    offset, point = 0, 0
+
+    def text_piece(start, end):
+        piece = CHARREF.sub(unescape_ref, data[start:end])
+        if raw or not piece or piece.translate(ASCII_SPACES): return piece
+        if any(el[0] in PRESERVE_WHITESPACE_TAGS for el in stack): return piece
+        return '\n' if '\n' in piece else ' '
+
+    for match in MARKUP.finditer(data):
+        piece = text_piece(point, match.start())
+        pieces.append(piece)
+        offset += len(piece)
+        point = match.end()
+
+        tag = match.group(2)
+        if tag is None: continue  # comment, declaration or bogus end tag
+        tag = tag.lower()
+        if not match.group(1):
+            element = [tag, offset, None, len(elements), None]
+            elements.append(element)
+            if match.group(0).endswith('/>'):
+                element[2], element[4] = offset, len(elements)
+            else:
+                stack.append(element)
+        else:
+            # Close the innermost open element with this tag, unmatched end tags are ignored
+            for depth in range(len(stack) - 1, -1, -1):
+                if stack[depth][0] == tag:
+                    for element in stack[depth:]: element[2], element[4] = offset, len(elements)
+                    del stack[depth:]
+                    break
+    piece = text_piece(point, len(data))
+    pieces.append(piece)
+    offset += len(piece)
+    for element in stack: element[2], element[4] = offset, len(elements)
+
+    return SgmDocument(''.join(pieces), [tuple(el) for el in elements])
+
+
+if __name__ == '__main__':
+    # Benchmark against the BeautifulSoup path over the whole corpus: same text means same offsets.
+    from bs4 import BeautifulSoup
+    from Preprocess import PreprocessManager
+
+    man = PreprocessManager()
+    fnames = man.fname_search()
+
+    start = time.time()
+    bs4_texts = []
+    for sgm_fname, _ in fnames:
+        with open(sgm_fname, 'r') as f:
+            bs4_texts.append(BeautifulSoup(f.read(), features='html.parser').text)
+    bs4_time = time.time() - start
+
+    start = time.time()
+    texts = [read_sgm(sgm_fname).text for sgm_fname, _ in fnames]
+    reader_time = time.time() - start
+    raw_texts = [read_sgm(sgm_fname, raw=True).text for sgm_fname, _ in fnames]
+
+    same = sum(1 for a, b in zip(bs4_texts, texts) if a == b)
+    print('identical text: {}/{}'.format(same, len(fnames)))
+    for (sgm_fname, _), a, b in zip(fnames, bs4_texts, texts):
+        if a != b: print('  differs: {}'.format(sgm_fname))
+
+    # Entity heads found at their APF START/END offsets, for both kinds of text
+    total, matched, raw_matched = 0, 0, 0
+    for (_, xml_fname), text, raw_text in zip(fnames, texts, raw_texts):
+        entities, _, _ = man.parse_one_xml(xml_fname)
+        for entity in entities:
+            for mention in entity['mention']:
+                start, end = mention['head']['position']
+                total += 1
+                if text[start:end + 1] == mention['head']['text']: matched += 1
+                if raw_text[start:end + 1] == mention['head']['text']: raw_matched += 1
+    print('entity heads at their offsets: {}/{}  (raw=True: {}/{})'.format(matched, total, raw_matched, total))
+    print('BeautifulSoup: {:.2f}s  SgmReader: {:.2f}s  ({:.1f}x)'.format(bs4_time, reader_time, bs4_time / max(reader_time, 1e-9)))
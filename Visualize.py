@@ -1,36 +1,48 @@
-def draw(epoch, input_x, input_y, predicts, input_c_pos, id2label, id2word):
+def open_page(epoch):
     sents_visual_file = './visualization/{}.html'.format(epoch)
+    html_file = open(sents_visual_file, "w")
+    html_file.write('<!DOCTYPE html><html lang="ko"><head><meta charset="UTF-8"/></head>')
+    return html_file
+
+
+def close_page(html_file):
+    html_file.write('</html>')
+    html_file.close()
 
+
+def draw_batch(html_file, input_x, input_y, predicts, input_c_pos, id2label, id2word):
+    # Writes the misclassified candidates of one batch, so the page is built chunk by chunk
     batch_size = len(input_y)
-    with open(sents_visual_file, "w") as html_file:
-        html_file.write('<!DOCTYPE html><html lang="ko"><head><meta charset="UTF-8"/></head>')
-
-        for i in range(batch_size):
-            if input_y[i] == predicts[i]: continue
-
-            sent_size = len(input_x[i])
-            current_pos = 0
-            for j in range(sent_size):
-                if input_c_pos[i][j] == 0:
-                    current_pos = j
-                    break
-
-            sent = ''
-            for j in range(sent_size):
-                word = id2word[input_x[i][j]]
-                if word == '<eos>': continue
-                if j == current_pos:
-                    sent += '<span style="background: rgba(255, 0, 0, 0.4);">{}</span> '.format(word)
-                else:
-                    sent += word + ' '
-
-            html_file.write('<p style="padding: 20px 0 5px 0;">{}</p>'.format(sent))
-            html_file.write('<div>Prediction: {}</div>'.format(id2label[predicts[i]]))
-            html_file.write('<div>Answer: {}</div>'.format(id2label[input_y[i]]))
-
-            html_file.write('</div>')
-
-        html_file.write('</html>')
+    for i in range(batch_size):
+        if input_y[i] == predicts[i]: continue
+
+        sent_size = len(input_x[i])
+        current_pos = 0
+        for j in range(sent_size):
+            if input_c_pos[i][j] == 0:
+                current_pos = j
+                break
+
+        sent = ''
+        for j in range(sent_size):
+            word = id2word[input_x[i][j]]
+            if word == '<eos>': continue
+            if j == current_pos:
+                sent += '<span style="background: rgba(255, 0, 0, 0.4);">{}</span> '.format(word)
+            else:
+                sent += word + ' '
+
+        html_file.write('<p style="padding: 20px 0 5px 0;">{}</p>'.format(sent))
+        html_file.write('<div>Prediction: {}</div>'.format(id2label[predicts[i]]))
+        html_file.write('<div>Answer: {}</div>'.format(id2label[input_y[i]]))
+
+        html_file.write('</div>')
+
+
+def draw(epoch, input_x, input_y, predicts, input_c_pos, id2label, id2word):
+    html_file = open_page(epoch)
+    draw_batch(html_file, input_x, input_y, predicts, input_c_pos, id2label, id2word)
+    close_page(html_file)
 
 
 if __name__ == '__main__':
@@ -1,4 +1,4 @@
-from bs4 import BeautifulSoup
+from SgmReader import read_sgm
 
 if __name__ == '__main__':
     """
@@ -7,8 +7,5 @@ if __name__ == '__main__':
       <charseq START="754" END="793">Secretary of Homeland Security Tom Ridge</charseq>
     </extent>
     """
-    with open('./data/ace_2005_td_v7/data/English/bc/adj/CNN_CF_20030303.1900.00.sgm', 'r') as f:
-        data = f.read()
-        soup = BeautifulSoup(data, features='html.parser')
-        text = soup.text
-        print(text[754-1:793])
+    text = read_sgm('./data/ace_2005_td_v7/data/English/bc/adj/CNN_CF_20030303.1900.00.sgm').text
+    print(text[754-1:793])